@@ -0,0 +1,47 @@
+import time, sys
+import numpy as np
+
+sys.path.append('.')
+import vrmagicTransformer, vrmagicSim
+
+cam=vrmagicSim.SimCamera()
+trsf=vrmagicTransformer.VRMagicTransformer(cam)
+payloads=cam.payloadBytes(range(4096))
+totalFrames=int(sys.argv[1]) if len(sys.argv)>1 else 16384
+
+def bench(func):
+    t0=time.perf_counter()
+    func()
+    return totalFrames/(time.perf_counter()-t0)
+
+def perFrame():
+    for i in range(totalFrames): trsf.payload2dict(payloads[i%len(payloads)])
+print('%-12s %12.0f frames/s'%('payload2dict',bench(perFrame)))
+
+for batch in [2**i for i in range(13)]:
+    out=(np.empty((batch,2048),dtype='float32'),np.empty((batch,2048),dtype='float32'),np.empty((batch,2048),dtype='uint16'))
+    footer=np.empty(batch,dtype=vrmagicTransformer.footerDtype)
+    def batched():
+        for i in range(0,totalFrames,batch):
+            j=i%len(payloads)
+            trsf.payloads2arrays(payloads[j:j+batch],out=out,footer=footer)
+    print('%-12s %12.0f frames/s'%('batch=%d'%batch,bench(batched)))
+
+# transformation only: multiply-add with invalid masking (as before lookup tables) vs. table lookup, for each output type
+lutFrames=int(sys.argv[2]) if len(sys.argv)>2 else 100000
+block=1000
+raw=np.stack([np.frombuffer(p[:4096],dtype='int16') for p in payloads[:block]])
+for coordDtype in vrmagicTransformer.coordDtypes:
+    t=vrmagicTransformer.VRMagicTransformer(vrmagicSim.SimCamera(),coordDtype=coordDtype)
+    out=np.empty(raw.shape,dtype=t.coordDtype)
+    def arith():
+        for i in range(0,lutFrames,block):
+            ret=(t.cs*raw+t.co)*t.coordMult
+            ret[raw==t.invalid]=t.coordInvalid
+            out[:]=ret
+    def lut():
+        for i in range(0,lutFrames,block): np.take(t.lutC,raw.view('uint16'),out=out)
+    for name,func in [('arithmetic',arith),('lookup',lut)]:
+        t0=time.perf_counter()
+        func()
+        print('%-8s %-12s %12.0f frames/s'%(coordDtype,name,lutFrames/(time.perf_counter()-t0)))
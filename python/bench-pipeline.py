@@ -0,0 +1,149 @@
+import time, sys, os, tempfile, threading
+import numpy as np
+
+sys.path.append('.')
+import vrmagicTransformer, vrmagicSim, vrmagicTrigger, vrmagicSync, vrmagicH5Writer, vrmagicMetrics, vrmagicAcquisition, vrmagicPool, vrmagicHeightMap
+
+# end-to-end benchmark of processing stages on simulated sensor data (no sensor needed): decoding into the ring, trigger, height map, sync gathering, HDF5 writing, decoding and compression in worker processes, and all together
+# arguments: number of frames per stage (default 20000), duration of the end-to-end run in seconds (default 5), HDF5 dump to replay instead of synthetic data
+totalFrames=int(sys.argv[1]) if len(sys.argv)>1 else 20000
+duration=float(sys.argv[2]) if len(sys.argv)>2 else 5.
+replay=sys.argv[3] if len(sys.argv)>3 else None
+
+def mkCam(**kw): return vrmagicSim.ReplayCamera(replay,**kw) if replay else vrmagicSim.SimCamera(**kw)
+
+def report(stage,frames,dt,hist,**extra):
+    s=hist.summary()
+    print('%-14s %10.0f frames/s   latency p50 %8.1f µs  p99 %8.1f µs  max %8.1f µs'%(stage,frames/dt,1e6*s['p50'],1e6*s['p99'],1e6*s['max'])+''.join('  %s %s'%kv for kv in extra.items()))
+
+cam=mkCam(fps=1000)
+trsf=vrmagicTransformer.VRMagicTransformer(cam)
+fn,_=cam.schedule(4096)
+payloads=cam.payloads(fn)
+
+# decode: one frame at a time into the ring, as the acquisition thread does (latency per frame)
+ring=vrmagicTransformer.FrameRing(4096,trsf.width,policy='dropOldest')
+hist=vrmagicMetrics.Histogram()
+t0=time.perf_counter()
+for i in range(totalFrames):
+    t1=time.perf_counter()
+    trsf.raw2ring(payloads[i%len(payloads)],ring)
+    hist.observe(time.perf_counter()-t1)
+report('decode',totalFrames,time.perf_counter()-t0,hist,dropped=ring.dropped)
+
+# decoded frames for the following stages
+C,A,I,F=trsf.raw2arrays(payloads)
+batch=256
+def batches():
+    for i in range(0,totalFrames,batch):
+        j=i%len(payloads)
+        yield C[j:j+batch],A[j:j+batch],I[j:j+batch],F[j:j+batch]
+
+# trigger: batches of frames (latency per batch)
+class CountingSink:
+    def __init__(self): self.windows=self.recorded=0
+    def start(self,windowNo): pass
+    def frames(self,C,A,I,footer): self.recorded+=len(footer)
+    def end(self,windowNo): self.windows+=1
+sink=CountingSink()
+trig=vrmagicTrigger.Trigger([vrmagicTrigger.Threshold(vrmagicTrigger.meanZ,-4,-5)],sink,trsf.width,pre=100,post=100)
+hist=vrmagicMetrics.Histogram()
+t0=time.perf_counter()
+for b in batches():
+    t1=time.perf_counter()
+    trig.process(*b)
+    hist.observe(time.perf_counter()-t1)
+trig.close()
+report('trigger',totalFrames,time.perf_counter()-t0,hist,batch=batch,windows=sink.windows,recorded=sink.recorded)
+
+# height map: resampling onto a grid as wide as the profile, one row per encoder step (latency per batch)
+xGrid=np.linspace(np.nanmin(A),np.nanmax(A),trsf.width)
+hmap=vrmagicHeightMap.HeightMap(xGrid,dy=cam.encoderPerFrame,keep=False)
+t0=time.perf_counter()
+for b in batches(): hmap.process(*b)
+hmap.close()
+report('height map',totalFrames,time.perf_counter()-t0,hmap.processLatency,batch=batch,rows=hmap.rows)
+
+# sync: two sensors with independent frame loss, arriving interleaved with delays between sensors (latency per frame); gathered events are never consumed, the oldest ones are dropped
+nSensors=2
+cams=[mkCam(fps=1000,loss=.01,mdbId=i,seed=i) for i in range(nSensors)]
+frames=[]
+for s,c in enumerate(cams):
+    fn,_=c.schedule(min(totalFrames,4096))
+    # arrival key: frame number plus up to 3 frames of delay; each sensor delivers in order
+    keys=np.maximum.accumulate(fn+3*np.random.random(len(fn)))
+    frames+=[(k,s,n) for k,n in zip(keys,fn)]
+frames.sort()
+gatherer=vrmagicSync.EvSyncGatherer(nSensors,trsf.width,outSize=8192,policy='dropOldest')
+hist=vrmagicMetrics.Histogram()
+t0=time.perf_counter()
+for k in range(totalFrames):
+    key,s,n=frames[k%len(frames)]
+    i=n%len(payloads)
+    t1=time.perf_counter()
+    gatherer.push(s,C[i],A[i],I[i],F[i])
+    hist.observe(time.perf_counter()-t1)
+report('sync',totalFrames,time.perf_counter()-t0,hist,sensors=nSensors,**gatherer.metrics()[0])
+
+# HDF5: raw and transformed dumps, compression in the writer thread and in a pool of worker threads (latency per written block)
+tmp=tempfile.mkdtemp()
+for raw in (True,False):
+    for workers in (0,4):
+        h5name=os.path.join(tmp,'bench-%s-%d.h5'%('raw' if raw else 'trsf',workers))
+        CC,AA,_,_=trsf.raw2arrays(payloads,transform=not raw)
+        t0=time.perf_counter()
+        with vrmagicH5Writer.H5Writer(h5name,'dump-0',vrmagicH5Writer.frameColumns(trsf.width,raw=raw),workers=workers,attrs=trsf.rawAttrs() if raw else {}) as w:
+            for i in range(0,totalFrames,batch):
+                j=i%len(payloads)
+                w.appendFrames(CC[j:j+batch],AA[j:j+batch],I[j:j+batch],F[j:j+batch])
+        stats=w.stats()
+        report('hdf5 %s w=%d'%('raw' if raw else 'trsf',workers),stats['rows'],time.perf_counter()-t0,w.writeLatency,MB=round(os.path.getsize(h5name)/2**20,1))
+        os.remove(h5name)
+
+# decoding and compression (raw dump) in worker processes fed from shared-memory payload ring, for increasing number of workers (latency per block in a worker)
+block=4096
+for workers in sorted(set([1,2,4,os.cpu_count()])):
+    h5name=os.path.join(tmp,'bench-pool-%d.h5'%workers)
+    ring=vrmagicPool.SharedPayloadRing(4*block,trsf.payloadSize,policy='block')
+    pool=vrmagicPool.DecodePool(trsf,ring,workers=workers,block=block,raw=True,compressionOpts=1)
+    producing=True
+    def produce():
+        global producing
+        for i in range(totalFrames): ring.push(payloads[i%len(payloads)])
+        producing=False
+    t0=time.perf_counter()
+    prod=threading.Thread(target=produce)
+    prod.start()
+    with vrmagicH5Writer.H5Writer(h5name,'dump-0',vrmagicH5Writer.frameColumns(trsf.width,raw=True),chunkRows=block,attrs=trsf.rawAttrs()) as w:
+        for frames,chunks in pool.batches(lambda: producing): w.appendCompressed(len(frames[-1]),chunks)
+    prod.join()
+    report('pool w=%d'%workers,w.stats()['rows'],time.perf_counter()-t0,pool.blockLatency,MB=round(os.path.getsize(h5name)/2**20,1))
+    pool.close()
+    ring.close()
+    os.remove(h5name)
+
+# end-to-end: simulated sensor as fast as possible → ring → trigger (on raw coordinates: thresholds of the trigger stage converted to raw values) and HDF5 writer in the consumer
+cam=mkCam(fps=1000,loss=.001)
+trsf=vrmagicTransformer.VRMagicTransformer(cam)
+h5name=os.path.join(tmp,'bench-e2e.h5')
+acq=vrmagicAcquisition.SimAcquisition(cam,trsf,raw=True,realtime=False,policy='dropNewest')
+w=vrmagicH5Writer.H5Writer(h5name,'dump-0',vrmagicH5Writer.frameColumns(trsf.width,raw=True),workers=4,attrs=trsf.rawAttrs())
+sink=CountingSink()
+trig=vrmagicTrigger.Trigger([vrmagicTrigger.Threshold(vrmagicTrigger.meanZ,(-4-trsf.co)/trsf.cs,(-5-trsf.co)/trsf.cs,above=trsf.cs>0,invalid=trsf.invalid)],sink,trsf.width,pre=100,post=100,coordDtype='int16')
+hist=vrmagicMetrics.Histogram()
+t0=time.perf_counter()
+with acq:
+    for CC,AA,II,FF in acq.batches(4096,timeout=.1):
+        t1=time.perf_counter()
+        trig.process(CC,AA,II,FF)
+        w.appendFrames(CC,AA,II,FF)
+        hist.observe(time.perf_counter()-t1)
+        if time.perf_counter()-t0>duration: break
+trig.close()
+w.close()
+dt=time.perf_counter()-t0
+stats=acq.metrics()[0]
+report('end-to-end',stats['frames']-stats['dropped'],dt,acq.decodeLatency,dropped=stats['dropped'],lost=stats['lostFrames'],maxQueued=stats['maxQueued'],written=w.stats()['rows'])
+report('  consumer',w.stats()['rows'],dt,hist,windows=sink.windows,recorded=sink.recorded)
+os.remove(h5name)
+os.rmdir(tmp)
@@ -0,0 +1,33 @@
+import sys, datetime
+
+import gi
+gi.require_version('Aravis','0.6')
+from gi.repository import Aravis
+
+sys.path.append('.')
+import vrmagicTransformer, vrmagicAcquisition, vrmagicMetrics, vrmagicStats
+
+# static-scene monitoring / sensor drift check: per-column statistics of z and intensity are computed as frames arrive, only periodic snapshots are written (instead of dumping every frame, see continuous-save-hdf5.py)
+
+# start talking to the camera
+cam=Aravis.Camera.new()
+trsf=vrmagicTransformer.VRMagicTransformer(cam,cache='vrmagic-cache.json')
+# acquisition in bg thread, decoding frames straight into its ring; new frames are discarded if we lag more than the ring size
+acq=vrmagicAcquisition.Acquisition(cam,trsf,nBuffers=2048,ringSize=16384,policy='dropNewest')
+
+# name of the statistics file, can be recycled
+h5name='vrmagic-stats.hdf5'
+# root group, new for every launch of this script
+h5root='stats-%s'%datetime.datetime.now().isoformat(timespec='seconds')
+# one snapshot every 10 s (of sensor time); outliers are values further than 6 sigma from the running mean of their column
+stats=vrmagicStats.ProfileStats(trsf.width,interval=10.,h5name=h5name,h5root=h5root,sigma=6,compressionOpts=4)
+
+# press ^C to quit; the last (incomplete) interval is written as well
+with acq, stats, vrmagicMetrics.MetricsExporter(dict(acq=acq,stats=stats),interval=10.,jsonName='vrmagic-metrics.jsonl'):
+    snapshots=0
+    for C,A,I,footer in acq.batches(4096,timeout=1.):
+        stats.process(C,A,I,footer)
+        if stats.snapshots==snapshots: continue
+        snapshots=stats.snapshots
+        st,ast=stats.stats(),acq.stats()
+        print(' {}: {} snapshots, {} frames, {:.1%} valid, {} z outliers; {:.5g} fps, {} dropped, {} lost'.format(h5name,snapshots,st['frames'],st['validFraction'],st['zOutliers'],ast['fps'],ast['dropped'],acq.gaps.lostFrames))
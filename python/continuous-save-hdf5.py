@@ -1,99 +1,68 @@
-import time, sys, collections, copy, ctypes, struct, os.path, datetime, threading
-import numpy as np, h5py
+import sys, os.path, datetime
 
 import gi
 gi.require_version('Aravis','0.6')
 from gi.repository import Aravis
 
 sys.path.append('.')
-import vrmagicTransformer
+import vrmagicTransformer, vrmagicH5Writer, vrmagicAcquisition, vrmagicMetrics, vrmagicPool
 
 # start talking to the camera
 cam=Aravis.Camera.new()
 # already sets some parameters by itself
-trsf=vrmagicTransformer.VRMagicTransformer(cam) #,yAOI=(700,300),xAOI=(650,800),fps=900)
+# (constants are cached on disk, see VRMagicTransformer *cache*; also usable to decode offline with VRMagicTransformer.fromCache)
+trsf=vrmagicTransformer.VRMagicTransformer(cam,cache='vrmagic-cache.json') #,yAOI=(700,300),xAOI=(650,800),fps=900)
 # increase scan rate
 #dev=cam.get_device()
 #dev.set_integer_feature_value('AcquisitionFrameRate_mHz',300000)
-stream=cam.create_stream(None,None)
-if not stream: raise RuntimeError("Failed to create stream (camera busy?).")
 
-# set up buffers and deque for thread comm
-payload=cam.get_payload()
-buflen=2048
-for i in range(0,buflen): stream.push_buffer(Aravis.Buffer.new_allocate(payload))
-bufQueue=collections.deque(maxlen=50*buflen) # discard anything unprocessed if more than 50 waiting already
+# save this many many consecutive frames as a single 2d array to HDF5
+h5chunk=4096
+# False stores z, x as float32 (as read by existing analysis tools); True stores raw int16 data and footer instead, half the size, which must be read through vrmagicReader.DumpReader (transforms them when read)
+raw=False
+# decode and compress in this many worker processes (payloads are passed through shared memory); 0 decodes in the acquisition thread and compresses in writer threads
+procWorkers=0
+if procWorkers>0:
+    # acquisition only copies raw payloads into the shared ring; the pool is created (worker processes forked) before acquisition creates the stream, which starts Aravis' receive thread, and before the writer's threads (threads Aravis.Camera.new started already do not matter: workers never call into Aravis or GLib)
+    ring=vrmagicPool.SharedPayloadRing(4*h5chunk,cam.get_payload(),policy='dropNewest')
+    pool=vrmagicPool.DecodePool(trsf,ring,workers=procWorkers,block=h5chunk,raw=raw,compressionOpts=1,shuffle=True)
+    acq=vrmagicAcquisition.Acquisition(cam,None,nBuffers=2048,ring=ring)
+# acquisition runs in bg thread, decoding frames straight into its ring; new frames are discarded if we lag more than the ring size
+else: acq=vrmagicAcquisition.Acquisition(cam,trsf,nBuffers=2048,ringSize=4*h5chunk,raw=raw,policy='dropNewest')
 
+# name of the dump file; with swmr, it can only be recycled if it was written in SWMR mode before (otherwise H5Writer fails when created, before acquisition starts: delete or rename the file)
+h5name='vrmagic-dump.hdf5'
+# True writes in single-writer/multiple-reader mode, so that the dump can be read while recording (e.g. tail-dump.py); data are flushed every second. If the process is killed while writing, the file stays marked as open and must be repaired with h5clear -s before it can be opened again
+swmr=False
+# root group, new for every launch of this script
+h5root='dump-%s'%datetime.datetime.now().isoformat(timespec='seconds')
+# HDF5 writer runs in its own thread; fast compression in 4 worker threads (gzip level 9 can't keep up with high frame rates)
+writer=vrmagicH5Writer.H5Writer(h5name,h5root,vrmagicH5Writer.frameColumns(trsf.width,raw=raw),chunkRows=h5chunk,compression='gzip',compressionOpts=1,shuffle=True,workers=0 if procWorkers else 4,attrs=trsf.rawAttrs() if raw else {},swmr=swmr,flushInterval=1.)
 
-def consumeBuffers():
-    'Consumes buffers from bufQueue, transforms, builds larger chunks and dumps to HDF5 onces in a while'
-    # save this many many consecutive frames as a single 2d array to HDF5
-    h5chunk=2*buflen
-    # name of the dump file, can be recycled
-    h5name='vrmagic-dump.hdf5'
-    # root group, new for every launch of this script
-    h5root='dump-%s'%datetime.datetime.now().isoformat(timespec='seconds')
-    # prepare chunk storage
-    CC=AA=II=TT=None
-    chunkRow=0
-    chunks=0
-    while True:
-        if not bufQueue:
-            time.sleep(0.005)
-            continue
-        sys.stderr.write('\b'); sys.stderr.flush() # delete the > written by the producer :)
-        d=trsf.payload2dict(bufQueue.pop())
-        C,A,I,timestamp=d['C'],d['A'],d['intensity'],np.array([[d['timestamp']]])
-        # add frame to larger chunks
-        if CC is None:
-            shape=(h5chunk,C.shape[0])
-            CC,AA,II,TT=np.empty(shape,dtype='float32'),np.empty(shape,dtype='float32'),np.empty(shape,dtype='float32'),np.empty((h5chunk,1),dtype='float32')
-        CC[chunkRow,:]=C; AA[chunkRow,:]=A; II[chunkRow,:]=I; TT[chunkRow,:]=timestamp
-        cols=CC.shape[1]
-        chunkRow+=1
-        # chunks full: save to HDF5 and start new group
-        if chunkRow%h5chunk!=0: continue
+# append acquisition health (frame loss, stream counters, queue depth, latencies) every 10 s as JSON line
+metrics=vrmagicMetrics.MetricsExporter(dict(acq=acq,writer=writer,**(dict(pool=pool) if procWorkers else {})),interval=10.,jsonName='vrmagic-metrics.jsonl')
 
-        with h5py.File(h5name,'a') as h5:
-            # create datasets from scratch, empty at first
-            if h5root not in h5:
-                for name,c,dtype in zip(['z','x','intensity','timestamp'],[cols,cols,cols,1],['float32','float32','uint16','float32']):
-                    h5.create_dataset(h5root+'/'+name,(0,c),maxshape=(None,c),dtype=dtype,compression='gzip',compression_opts=9)
-            # append outstanding data
-            for data,name in zip([CC,AA,II,TT],['z','x','intensity','timestamp']):
-                ds=h5[h5root+'/'+name]
-                #print(name,ds.shape)
-                ds.resize((ds.shape[0]+h5chunk,ds.shape[1]))
-                # print(name,ds.shape,data.shape,ds[-h5chunk:,:].shape)
-                ds[ds.shape[0]-h5chunk:,:]=data
-        chunks+=1
-        chunkRow=0
-        print(' {}: {} chunks, {} rows, {:_} bytes)'.format(h5name,chunks,chunks*h5chunk,os.path.getsize(h5name)))
+def batches():
+    'Yield ((C,A,I,footer),chunks) with chunks pre-compressed by the pool, or None.'
+    if procWorkers: yield from pool.batches(lambda: acq.running,timeout=1.)
+    else:
+        for frames in acq.batches(h5chunk,timeout=1.): yield frames,None
 
-
-# inspired by https://kushalvyas.github.io/gige_ubuntu.html
-def produceBuffers():
-    cam.start_acquisition()
-    t0=time.time()
-    N,Nmod=0,100
-    while True:
-        buf=stream.try_pop_buffer()
-        if not buf: # nothing to do, wait a little bit
-            time.sleep(0.005)
-            continue
-        # put on the consumer's table, just raw data
-        bufQueue.appendleft(buf.get_data())
-        sys.stderr.write('>'); sys.stderr.flush()
-        # free the buffer for further use
-        stream.push_buffer(buf)
-        # report fps once in a while
-        N+=1
-        if N%Nmod==0:
-            t1=time.time()
-            sys.stderr.write('%5g fps                                                    \r'%(Nmod*1./(t1-t0)));
-            t0=t1
-
-# start the consumer in bg thread
-t=threading.Thread(target=consumeBuffers).start()
-# run acquisition in fg forever; press ^C to quit
-produceBuffers()
+rows=0
+# consume frames forever; press ^C to quit (the writer then writes what it has and closes the file, the pool stops its workers and shared memory is released)
+try:
+    with acq, metrics:
+        for (CC,AA,II,FF),chunks in batches():
+            # data are copied into writer's block (or written as compressed chunks), ring slots are reused once we ask for the next batch
+            if chunks: writer.appendCompressed(len(FF),chunks)
+            else: writer.appendFrames(CC,AA,II,FF)
+            st=writer.stats()
+            if st['rows']==rows: continue
+            rows=st['rows']
+            ast=acq.stats()
+            print(' {}: {} rows, {:_} bytes, {:.1f} MB/s, backlog {} rows; {:.5g} fps, {} dropped, {} lost'.format(h5name,rows,os.path.getsize(h5name),st['MBPerSec'],st['backlog'],ast['fps'],ast['dropped'],(pool if procWorkers else acq).gaps.lostFrames))
+finally:
+    writer.close()
+    if procWorkers:
+        pool.close()
+        ring.close()
@@ -0,0 +1,172 @@
+import time, sys, threading
+import numpy as np
+
+sys.path.append('.')
+import vrmagicTransformer, vrmagicSim, vrmagicAcquisition, vrmagicMetrics, vrmagicSync, vrmagicTrigger, vrmagicTuner
+
+# smoke test of the acquisition pipeline on simulated sensors (no sensor, and no Aravis, needed): ring policies of Acquisition (drop counts and frame order), AOI width change during acquisition, lost-frame detection, sync gathering, trigger windows, throughput tuner; exits with non-zero status if any check fails
+# arguments: "fake" to also run acquisition and tuner against Aravis' fake camera (Fake_1, no VRMagic footers: frame order is not checked there)
+fake='fake' in sys.argv[1:]
+failures=0
+def check(what,ok,detail=''):
+    global failures
+    print('%s  %s%s'%('ok  ' if ok else 'FAIL',what,'  ('+detail+')' if detail else ''))
+    if not ok: failures+=1
+
+fakeCam=None
+def fakeCamera():
+    'Return Aravis\' fake camera Fake_1 (created on first use).'
+    global fakeCam
+    if fakeCam is None:
+        Aravis=vrmagicAcquisition.aravis()
+        Aravis.enable_interface('Fake')
+        fakeCam=Aravis.Camera.new('Fake_1')
+    return fakeCam
+
+def waitFrames(acq,n,timeout=10.):
+    'Wait until *acq* received *n* frames (at most *timeout* seconds).'
+    t0=time.time()
+    while acq.frames<n and time.time()-t0<timeout: time.sleep(.01)
+
+def drain(ring):
+    'Consume all frames in FrameRing *ring*, return their frame numbers.'
+    ret=[]
+    while len(ring):
+        footer=ring.peek(None)[-1]
+        ret.append(footer['frameNo'].copy())
+        ring.release(len(footer))
+    return np.concatenate(ret) if ret else np.zeros(0,dtype=vrmagicTransformer.footerDtype['frameNo'])
+
+def consumeWhileRunning(acq,n,sleep=.001):
+    'Consume frames of *acq* (slowly, with *sleep* after each batch) until *n* frames were received, then stop acquisition while still consuming (so that a blocked producer can finish); return footers (or payloads, without transformer) of all frames consumed.'
+    ret,stopper=[],None
+    for batch in acq.batches(16,timeout=.1):
+        ret.append(batch[-1].copy())
+        time.sleep(sleep)
+        if stopper is None and acq.frames>=n:
+            stopper=threading.Thread(target=acq.stop)
+            stopper.start()
+    stopper.join()
+    return np.concatenate(ret)
+
+# ring policies: the consumer does not read until the producer has delivered N frames into a ring of R slots
+N,R=1000,64
+for policy in ('dropNewest','dropOldest'):
+    cam=vrmagicSim.SimCamera(fps=1000,widthMax=256)
+    trsf=vrmagicTransformer.VRMagicTransformer(cam)
+    acq=vrmagicAcquisition.SimAcquisition(cam,trsf,ringSize=R,policy=policy,realtime=False)
+    acq.start()
+    waitFrames(acq,N)
+    acq.stop()
+    frameNos=drain(acq.ring)
+    check('%s: ring full'%policy,len(frameNos)==R,'%d frames kept'%len(frameNos))
+    check('%s: dropped counted'%policy,acq.ring.dropped==acq.frames-R,'%d dropped of %d'%(acq.ring.dropped,acq.frames))
+    expected=np.arange(R) if policy=='dropNewest' else np.arange(acq.frames-R,acq.frames)
+    check('%s: %s frames kept, in order'%(policy,'oldest' if policy=='dropNewest' else 'newest'),np.array_equal(frameNos,expected),'frames %d…%d'%(frameNos[0],frameNos[-1]))
+    check('%s: dropped frames are not lost'%policy,acq.gaps.lostFrames==0,'%d lost'%acq.gaps.lostFrames)
+
+# 'block': a slow consumer makes the producer wait, nothing is dropped
+cam=vrmagicSim.SimCamera(fps=1000,widthMax=256)
+acq=vrmagicAcquisition.SimAcquisition(cam,vrmagicTransformer.VRMagicTransformer(cam),ringSize=R,policy='block',realtime=False)
+acq.start()
+frameNos=consumeWhileRunning(acq,N)['frameNo']
+check('block: nothing dropped',acq.ring.dropped==0,'%d dropped'%acq.ring.dropped)
+check('block: all frames in order',np.array_equal(frameNos,np.arange(acq.frames)),'%d of %d frames'%(len(frameNos),acq.frames))
+
+# AOI width changed on the device behind the transformer's back: acquisition stops with an error rather than decoding into the ring of the old width
+cam=vrmagicSim.SimCamera(fps=1000,widthMax=256)
+acq=vrmagicAcquisition.SimAcquisition(cam,vrmagicTransformer.VRMagicTransformer(cam),ringSize=R,policy='dropOldest',realtime=False)
+error=None
+try:
+    with acq:
+        for i,batch in enumerate(acq.batches(16,timeout=.1)):
+            if i==2: cam.get_device().set_integer_feature_value('AOIWidth',128)
+except RuntimeError as e: error=e
+check('AOI width change stops acquisition',isinstance(error,RuntimeError) and isinstance(error.__cause__,ValueError) and not acq.running,repr(error.__cause__) if error else 'no error')
+
+if fake:
+    # without transformer, raw payloads go through PayloadRing
+    for policy in ('dropNewest','dropOldest'):
+        acq=vrmagicAcquisition.Acquisition(fakeCamera(),None,ringSize=4,policy=policy)
+        acq.start()
+        waitFrames(acq,20)
+        acq.stop()
+        check('Fake_1 %s: ring full, dropped counted'%policy,len(acq.ring)==4 and acq.ring.dropped==acq.frames-4,'%d kept, %d dropped of %d'%(len(acq.ring),acq.ring.dropped,acq.frames))
+        acq.close()
+    acq=vrmagicAcquisition.Acquisition(fakeCamera(),None,ringSize=4,policy='block')
+    acq.start()
+    received=len(consumeWhileRunning(acq,20))
+    check('Fake_1 block: nothing dropped',acq.ring.dropped==0 and received==acq.frames,'%d of %d frames'%(received,acq.frames))
+    acq.close()
+
+# frames lost by the sensor are detected from footer counters, also when counters wrap around
+cam=vrmagicSim.SimCamera(fps=1000,widthMax=256,loss=.01)
+acq=vrmagicAcquisition.SimAcquisition(cam,vrmagicTransformer.VRMagicTransformer(cam),ringSize=R,policy='block',realtime=False)
+acq.start()
+frameNos=consumeWhileRunning(acq,N,sleep=0)['frameNo']
+# (frames lost after the last one delivered can not be detected)
+lost=int(frameNos[-1])+1-len(frameNos)
+check('lost frames detected',acq.gaps.lostFrames==lost>0 and acq.ring.dropped==0,'%d detected, %d lost by the sensor'%(acq.gaps.lostFrames,lost))
+gaps=vrmagicMetrics.FrameGaps()
+for f in (65533,65534,65535,1,2): gaps.update(f,f%2**16)
+check('frame counter wrap-around',gaps.metrics()==dict(lostFrames=1,lostEvents=1,gaps=1,resets=0),str(gaps.metrics()))
+
+# sync: two simulated sensors in real time, each in its own acquisition thread, gathered by event number
+cams=vrmagicSim.simCameras(2,fps=1000,widthMax=256)
+synced=vrmagicSync.SyncedAcquisition(cams,[vrmagicTransformer.VRMagicTransformer(c) for c in cams],acqClass=vrmagicAcquisition.SimAcquisition)
+events=[]
+t0=time.time()
+with synced:
+    for C,A,I,footer in synced.batches(timeout=.1):
+        events.append(footer['eventNo'].copy())
+        if time.time()-t0>1.: break
+events=np.concatenate(events)
+st=synced.gatherer.metrics()[0]
+check('sync: events gathered',len(events)>0 and st['gathered']>=len(events),'%d gathered'%st['gathered'])
+check('sync: no incomplete or discarded events',st['incomplete']==st['discardedFrames']==0,'%d incomplete, %d frames discarded'%(st['incomplete'],st['discardedFrames']))
+check('sync: same event from all sensors, in order',np.all(events[:,0]==events[:,1]) and np.all(np.diff(events[:,0].astype(int))%2**16==1))
+
+# trigger: a part passes under the sensor for 500 frames of every 2000; the first one is under the sensor already at start (not recorded, requireEdge)
+class ListSink:
+    def __init__(self): self.windows=[]
+    def start(self,windowNo): self.windows.append([])
+    def frames(self,C,A,I,footer): self.windows[-1].append(footer['frameNo'].copy())
+    def end(self,windowNo): self.windows[-1]=np.concatenate(self.windows[-1])
+cam=vrmagicSim.SimCamera(fps=1000,widthMax=256,partEvery=2000,partLen=500)
+trsf=vrmagicTransformer.VRMagicTransformer(cam)
+payloads=cam.payloads(np.arange(5000))
+C,A,I,footer=trsf.raw2arrays(payloads)
+mz=vrmagicTrigger.meanZ(C,A,I)
+part,noPart=np.nanmean(mz[:500]),np.nanmean(mz[500:2000])
+sink=ListSink()
+trig=vrmagicTrigger.Trigger([vrmagicTrigger.Threshold(vrmagicTrigger.meanZ,(part+noPart)/2,above=part>noPart)],sink,trsf.width,pre=10,post=20)
+for i in range(0,5000,256): trig.process(C[i:i+256],A[i:i+256],I[i:i+256],footer[i:i+256])
+trig.close()
+check('trigger: windows',trig.windows==2,'%d windows'%trig.windows)
+check('trigger: pre- and post-trigger frames',trig.windows==2 and all(np.array_equal(w,np.arange(s-10,s+500+20)) for w,s in zip(sink.windows,(2000,4000))))
+# integer coordinates mark invalid values with coordInvalid rather than nan
+trsfUm=vrmagicTransformer.VRMagicTransformer(cam,coordDtype='int32um')
+Cum,Aum,Ium,_=trsfUm.raw2arrays(payloads[:500])
+check('trigger: statistics of int32um coordinates',np.allclose(vrmagicTrigger.meanZ(Cum,Aum,Ium,invalid=trsfUm.coordInvalid),1000*mz[:500],atol=1) and np.allclose(vrmagicTrigger.validFraction(Cum,Aum,Ium,invalid=trsfUm.coordInvalid),vrmagicTrigger.validFraction(C[:500],A[:500],I[:500])))
+
+# tuner: a sensor which loses frames above 2 kHz
+class LossyCamera(vrmagicSim.SimCamera):
+    def schedule(self,n):
+        self.loss=.01 if self.fps()>2000 else 0.
+        return vrmagicSim.SimCamera.schedule(self,n)
+cam=LossyCamera(fps=100,widthMax=256)
+trsf=vrmagicTransformer.VRMagicTransformer(cam)
+tuner=vrmagicTuner.ThroughputTuner(cam,trsf,rates=(1.,.5),refine=2,buffers=(4,16),settle=.2,measure=.5,acqClass=vrmagicAcquisition.SimAcquisition,log=lambda s: None)
+best=tuner.tune()
+check('tuner: loss-free rate found below the limit',best is not None and best['lossFree'] and .75*2000<=best['frameRate']<=2000,'%.1f Hz'%best['frameRate'] if best else 'none')
+check('tuner: lossy trials rejected',all(not t['lossFree'] for t in tuner.trials if t['frameRate']>2000))
+check('tuner: original settings restored',tuner.settings()==tuner.original)
+
+if fake:
+    tuner=vrmagicTuner.ThroughputTuner(fakeCamera(),None,rates=(1.,.5),refine=0,buffers=(4,16),settle=.2,measure=1.,log=lambda s: None)
+    # the fake camera may not keep up at its maximum frame rate on a loaded host, so only the mechanics are checked
+    best=tuner.tune()
+    check('Fake_1 tuner: trials run, original settings restored',len(tuner.trials)>0 and tuner.settings()==tuner.original,'best %.1f Hz'%best['frameRate'] if best else 'no loss-free setting')
+
+print('%d checks failed'%failures if failures else 'all checks passed')
+sys.exit(1 if failures else 0)
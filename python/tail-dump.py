@@ -0,0 +1,22 @@
+import sys
+import numpy as np
+
+sys.path.append('.')
+import vrmagicReader, vrmagicMetrics
+
+# follow a dump while it is being recorded in SWMR mode (continuous-save-hdf5.py with swmr=True; if it was killed, run h5clear -s on the file first), from another process; only newly appended frames are read
+# arguments: dump file (default vrmagic-dump.hdf5), group (default: newest dump-* group)
+h5name=sys.argv[1] if len(sys.argv)>1 else 'vrmagic-dump.hdf5'
+h5root=sys.argv[2] if len(sys.argv)>2 else None
+
+reader=vrmagicReader.DumpReader(h5name,h5root,swmr=True)
+gaps=vrmagicMetrics.FrameGaps()
+print('%s: %d frames recorded so far, following new ones'%(h5name,len(reader)))
+# ends 10 s after recording stops (or ^C)
+with reader:
+    for C,A,I,footer in reader.tail(poll=.5,timeout=10.):
+        # frame counters are only stored in raw dumps
+        if reader.raw:
+            for frameNo,eventNo in zip(footer['frameNo'].tolist(),footer['eventNo'].tolist()): gaps.update(frameNo,eventNo)
+        ts=footer['timestamp']
+        print(' {} frames (t={:.3f}…{:.3f} s), mean z {:.3f}, {:.1%} valid; {} frames total, {} lost'.format(len(footer),ts[0],ts[-1],np.nanmean(C),np.mean(~np.isnan(C)),len(reader),gaps.lostFrames))
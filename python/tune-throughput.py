@@ -0,0 +1,26 @@
+import sys
+
+import gi
+gi.require_version('Aravis','0.6')
+from gi.repository import Aravis
+
+sys.path.append('.')
+import vrmagicTransformer, vrmagicTuner
+
+# find the highest loss-free frame rate, with packet size, inter-packet delay and the smallest buffer pool sustaining it
+# arguments: camera id (default: first camera found; with Aravis' fake GigE camera running, i.e. arv-fake-gv-camera-0.6, its id is Aravis-GV01), "apply" to leave the best settings on the camera
+camId=sys.argv[1] if len(sys.argv)>1 else None
+apply='apply' in sys.argv[2:]
+
+cam=Aravis.Camera.new(camId)
+dev=cam.get_device()
+# footers are only decoded (and checked for lost frames) with VRMagic sensors; the transformer also programs the AOI, which determines the maximum frame rate
+trsf=vrmagicTransformer.VRMagicTransformer(cam,cache='vrmagic-cache.json') if vrmagicTuner.hasFeature(dev,'IntraFooterFrameCounterByteOffset') else None
+
+tuner=vrmagicTuner.ThroughputTuner(cam,trsf)
+print('Maximum frame rate %.1f Hz, packet sizes %s, packet delays %s'%(tuner.maxFrameRate(),tuner.packetSizes,tuner.packetDelays))
+best=tuner.tune(apply=apply)
+if best is None: print('No loss-free setting found.')
+else:
+    print('Best loss-free setting: %(frameRate).1f Hz (%(fps).1f fps delivered), packet size %(packetSize)s, packet delay %(packetDelay)s, %(nBuffers)d buffers'%best)
+    print('%s; pass nBuffers=%d to Acquisition'%('Applied' if apply else 'Not applied (pass "apply")',best['nBuffers']))
@@ -0,0 +1,177 @@
+import threading, asyncio, time
+
+import vrmagicTransformer, vrmagicMetrics
+
+
+def aravis():
+    'Return the Aravis module (PyGObject), imported on first use, so that SimAcquisition (and modules using this one) work without it.'
+    import gi
+    gi.require_version('Aravis','0.6')
+    from gi.repository import Aravis
+    return Aravis
+
+
+def iterRing(ring,isRunning,n=None,timeout=.1):
+    '''
+    Yield batches of at most *n* frames from *ring* (all available if None; see FrameRing.peek); frames of each batch are released when the next one is requested. Iteration ends once isRunning() returns False and the ring is drained.
+    '''
+    while isRunning() or len(ring):
+        batch=ring.peek(n,timeout=timeout if isRunning() else None)
+        k=len(batch[-1])
+        if k==0: continue
+        try: yield batch
+        finally: ring.release(k)
+
+
+async def aiterRing(ring,isRunning,n=None,timeout=.1):
+    'Asynchronous variant of iterRing; waiting for frames runs in the default executor, not blocking the event loop.'
+    loop=asyncio.get_running_loop()
+    while isRunning() or len(ring):
+        batch=await loop.run_in_executor(None,ring.peek,n,timeout if isRunning() else None)
+        k=len(batch[-1])
+        if k==0: continue
+        try: yield batch
+        finally: ring.release(k)
+
+
+class Acquisition:
+    '''
+    Runs acquisition from camera *cam* in a background thread and hands frames over to the consumer through a bounded ring.
+
+    The producer waits for Aravis buffers with blocking timed pops (no polling), decodes them straight from buffer memory into the ring (VRMagicTransformer.buffer2ring) and returns them to the stream right away. Without transformer (*trsf* is None, e.g. with Aravis' fake camera), raw payloads are copied into PayloadRing instead.
+
+    The consumer iterates over batches of frames (for batch in acq: ..., or async for batch in acq: ...); each batch is a tuple of views into the ring (C,A,I,footer), or (payload,) without transformer, valid until the next batch is requested.
+
+    *policy* decides what happens when the consumer falls behind, see vrmagicTransformer.RingBase; dropped frames are counted in stats().
+
+    Health of the acquisition is tracked in metrics(): frames lost before reaching the host are detected from gaps in footer counters (*gaps*), decoding time of each frame is recorded in *decodeLatency* and stream counters of Aravis are included; see vrmagicMetrics.MetricsExporter for periodic export.
+    '''
+    def __init__(self,cam,trsf=None,nBuffers=64,ringSize=4096,policy='dropNewest',raw=False,popTimeout=.1,ring=None):
+        '''
+        *nBuffers* Aravis buffers are allocated for the stream; *ringSize* frames fit the ring. *raw* stores raw coordinates in the ring (see FrameRing). A ring created elsewhere can be passed as *ring* (*ringSize*, *policy* and *raw* are then ignored). *popTimeout* (in seconds) bounds how long the producer waits for a buffer before checking whether it should stop.
+        '''
+        Aravis=aravis()
+        self.cam,self.trsf,self.popTimeout=cam,trsf,popTimeout
+        self.success=Aravis.BufferStatus.SUCCESS
+        self.stream=cam.create_stream(None,None)
+        if not self.stream: raise RuntimeError("Failed to create stream (camera busy?).")
+        payload=cam.get_payload()
+        for i in range(nBuffers): self.stream.push_buffer(Aravis.Buffer.new_allocate(payload))
+        if ring is not None: self.ring=ring
+        elif trsf: self.ring=vrmagicTransformer.FrameRing(ringSize,trsf.width,coordDtype=trsf.coordDtype,raw=raw,policy=policy)
+        else: self.ring=vrmagicTransformer.PayloadRing(ringSize,payload,policy=policy)
+        self.frames=self.failures=0
+        self.maxQueued=0
+        self.gaps=vrmagicMetrics.FrameGaps()
+        self.decodeLatency=vrmagicMetrics.Histogram()
+        self.running=False
+        self.thread=None
+        self.error=None
+    def start(self):
+        'Start acquisition on the camera and the producer thread.'
+        self.running=True
+        self.error=None
+        self.t0=time.time()
+        self.cam.start_acquisition()
+        self.thread=threading.Thread(target=self._run,daemon=True)
+        self.thread.start()
+    def stop(self):
+        'Stop the producer thread and acquisition on the camera; frames already in the ring can still be consumed.'
+        self.running=False
+        if self.thread: self.thread.join()
+        self.cam.stop_acquisition()
+    def close(self):
+        'Release the stream and its buffers (after stop), e.g. before creating another acquisition on the same camera.'
+        self.stream=None
+    def __enter__(self):
+        self.start()
+        return self
+    def __exit__(self,*args): self.stop()
+    def _run(self):
+        'Run the producer loop; an exception (e.g. AOI width changed during acquisition, see VRMagicTransformer.raw2arrays) stops acquisition, and batches raises it in the consumer.'
+        try: self._produce()
+        except Exception as e:
+            self.error=e
+            self.running=False
+    def _checkError(self):
+        if self.error: raise RuntimeError('Acquisition producer thread failed.') from self.error
+    def _produce(self):
+        usec=int(self.popTimeout*1e6)
+        while self.running:
+            buf=self.stream.timeout_pop_buffer(usec)
+            if buf is None: continue
+            if buf.get_status()==self.success: self._store(vrmagicTransformer.bufferView(buf))
+            else: self.failures+=1
+            self.stream.push_buffer(buf)
+    def _store(self,raw):
+        'Decode payload *raw* (uint8 array) into the ring (or copy it, without transformer) and update statistics.'
+        t0=time.perf_counter()
+        if self.trsf:
+            i=self.trsf.raw2ring(raw,self.ring)
+            self.decodeLatency.observe(time.perf_counter()-t0)
+            # frames not stored in the ring (dropped) are not decoded, so their footer is unknown
+            if i is None: self.gaps.skip()
+            else: self.gaps.update(int(self.ring.footer['frameNo'][i]),int(self.ring.footer['eventNo'][i]))
+        else: self.ring.push(raw)
+        self.frames+=1
+        self.maxQueued=max(self.maxQueued,len(self.ring))
+    def streamStats(self):
+        'Return Aravis stream counters as dict (completed buffers, failures, underruns).'
+        completed,failures,underruns=self.stream.get_statistics()
+        return dict(completed=completed,failures=failures,underruns=underruns)
+    def stats(self):
+        '''
+        Return dict with frames received, failed buffers, frames dropped by the ring policy, frames waiting in the ring and average fps since start.
+        '''
+        return dict(frames=self.frames,failures=self.failures,dropped=self.ring.dropped,queued=len(self.ring),fps=self.frames/(time.time()-self.t0))
+    def metrics(self):
+        'Return (scalars,histograms) for vrmagicMetrics.MetricsExporter: stats(), maximum ring depth, Aravis stream counters (prefixed with stream_), frame-loss counters from footer gaps and decode latency.'
+        scalars=dict(self.stats(),maxQueued=self.maxQueued,**{'stream_'+k:v for k,v in self.streamStats().items()},**self.gaps.metrics())
+        return scalars,dict(decode_seconds=self.decodeLatency)
+    def batches(self,n=None,timeout=.1):
+        'Yield batches of at most *n* frames, until acquisition is stopped and the ring drained; see iterRing. RuntimeError is raised at the end if the producer thread failed.'
+        yield from iterRing(self.ring,lambda: self.running,n,timeout)
+        self._checkError()
+    def __iter__(self): return self.batches()
+    async def abatches(self,n=None,timeout=.1):
+        'Asynchronous variant of batches, see aiterRing.'
+        async for batch in aiterRing(self.ring,lambda: self.running,n,timeout): yield batch
+        self._checkError()
+    def __aiter__(self): return self.abatches()
+
+
+class SimAcquisition(Acquisition):
+    '''
+    Acquisition from simulated sensor *cam* (vrmagicSim.SimCamera or ReplayCamera) instead of an Aravis stream; frames are generated in the producer thread and go through the same decoding, ring and statistics as with a real sensor, so that everything downstream can be run and measured without hardware.
+
+    With *realtime*, frames are delivered at the frame rate of the camera (the producer sleeps until each frame is due); otherwise as fast as they can be generated and decoded. Payloads are generated *block* frames at a time.
+    '''
+    def __init__(self,cam,trsf=None,ringSize=4096,policy='dropNewest',raw=False,ring=None,realtime=True,block=64,**kw):
+        '*kw* (e.g. *nBuffers*) are accepted for compatibility with Acquisition and ignored.'
+        self.cam,self.trsf,self.realtime,self.block=cam,trsf,realtime,block
+        if ring is not None: self.ring=ring
+        elif trsf: self.ring=vrmagicTransformer.FrameRing(ringSize,trsf.width,coordDtype=trsf.coordDtype,raw=raw,policy=policy)
+        else: self.ring=vrmagicTransformer.PayloadRing(ringSize,cam.get_payload(),policy=policy)
+        self.frames=self.failures=0
+        self.maxQueued=0
+        self.gaps=vrmagicMetrics.FrameGaps()
+        self.decodeLatency=vrmagicMetrics.Histogram()
+        self.running=False
+        self.thread=None
+        self.error=None
+    def _produce(self):
+        # times are counted from the first frame scheduled, so that acquisition can be restarted (possibly at a different frame rate)
+        t0,tFirst=time.perf_counter(),None
+        while self.running:
+            frameNos,times=self.cam.schedule(self.block)
+            payloads=self.cam.payloads(frameNos)
+            if tFirst is None and len(times): tFirst=times[0]
+            for p,t in zip(payloads,times):
+                if self.realtime:
+                    wait=t0+t-tFirst-time.perf_counter()
+                    if wait>0: time.sleep(wait)
+                if not self.running: return
+                self._store(p)
+    def streamStats(self):
+        'Return counters like Acquisition.streamStats; frames lost by the simulated sensor count as underruns.'
+        return dict(completed=self.frames,failures=0,underruns=int(self.cam.lost))
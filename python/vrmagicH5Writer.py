@@ -0,0 +1,205 @@
+import numpy as np, h5py
+import threading, time, zlib, concurrent.futures, atexit
+import vrmagicMetrics
+from vrmagicTransformer import footerDtype
+
+
+def frameColumns(width,raw=False,coordDtype='float32'):
+    '''
+    Return columns for H5Writer storing decoded frames *width* columns wide: transformed coordinates z, x (of *coordDtype*), intensity and timestamp; with *raw*, untransformed c16, a16, i16 (int16, half the size of float32) and all footer fields.
+    '''
+    if raw: return [('c16',width,'int16'),('a16',width,'int16'),('i16',width,'uint16')]+[(f,1,footerDtype[f]) for f in footerDtype.names]
+    return [('z',width,coordDtype),('x',width,coordDtype),('intensity',width,'uint16'),('timestamp',1,'float32')]
+
+
+def frameData(C,A,I,footer,raw=False):
+    'Return dict of arrays for columns created by frameColumns, from decoded frames.'
+    if raw: return dict(c16=C,a16=A,i16=I,**{f:footer[f][:,None] for f in footerDtype.names})
+    return dict(z=C,x=A,intensity=I,timestamp=footer['timestamp'][:,None])
+
+
+def compressChunk(arr,level,shuffle=True):
+    'Compress chunk *arr* the same way the HDF5 filter pipeline would (byte shuffle, then deflate at gzip *level*), for direct chunk writes.'
+    if shuffle: arr=arr.reshape(-1).view(np.uint8).reshape(-1,arr.itemsize).T
+    return zlib.compress(np.ascontiguousarray(arr).data,level)
+
+
+class H5Writer:
+    '''
+    Append blocks of frames to extensible 2d HDF5 datasets (one per quantity, under a common group) from a background thread, keeping the file open for the whole run.
+
+    Call close() when done (or use the writer as context manager); writers still open at exit are closed then, so that buffered rows are not lost and the file is left closed properly.
+
+    Frames are appended (append) into one of two preallocated blocks of *chunkRows* rows; a full block is handed over to the writer thread and filling continues in the other block, so the caller only waits if the writer is more than one block behind.
+
+    Compression is set with *compression* and *compressionOpts* (as in h5py.Group.create_dataset) and *shuffle*. With *workers*>0 and gzip compression, full blocks are compressed by a pool of that many threads (zlib releases the GIL, unlike the HDF5 filter pipeline invoked through h5py) and written as pre-compressed chunks, bypassing the filter pipeline.
+
+    With *swmr*, the file is written in single-writer/multiple-reader mode, so that it can be read while being written (see vrmagicReader.DumpReader.tail): datasets are created and the file switched to SWMR mode when the writer is created (so that a file which can not be written in SWMR mode fails right away, not once data arrive), and rows of the block being filled are written (and flushed) every *flushInterval* seconds, not only once the block is full. Such partial writes keep chunk alignment (the block is written once more when full) and are skipped while the writer is busy, so that the caller does not wait for them. SWMR needs the latest HDF5 file format: the file must be new or have been written in SWMR mode before, and no other groups can be created while writing.
+    '''
+    def __init__(self,h5name,h5root,columns,chunkRows=4096,compression='gzip',compressionOpts=1,shuffle=True,workers=0,mode='a',attrs={},swmr=False,flushInterval=1.):
+        '''
+        *columns* is a sequence of (name,cols,dtype) describing datasets which are created under *h5root* in *h5name* (opened with *mode*); see frameColumns. *attrs* maps dataset names to dictionaries of attributes set on them (see VRMagicTransformer.rawAttrs).
+        '''
+        self.h5name,self.h5root,self.chunkRows=h5name,h5root,chunkRows
+        self.columns=[(name,cols,np.dtype(dtype)) for name,cols,dtype in columns]
+        self.compression,self.compressionOpts,self.shuffle,self.mode,self.attrs=compression,compressionOpts,shuffle,mode,attrs
+        self.swmr,self.flushInterval=swmr,flushInterval
+        self.raw='c16' in [c[0] for c in self.columns]
+        if workers>0 and compression!='gzip': raise ValueError("Compression in worker threads is only supported with compression='gzip'.")
+        self.pool=concurrent.futures.ThreadPoolExecutor(workers) if workers>0 else None
+        self.blocks=[{name:np.empty((chunkRows,cols),dtype=dtype) for name,cols,dtype in self.columns} for i in (0,1)]
+        # block being filled by the caller, rows filled in it
+        self.fill,self.row=0,0
+        # rows handed to the writer before the block being filled (its first row, relative to rows present when the file was opened)
+        self.rowsQueued=0
+        # block handed to the writer thread as (block,rows,None,start,partial), or pre-compressed chunks as (None,rows,chunks,start,False); *partial* are rows of a block still being filled (SWMR flush); None if nothing is pending
+        self.pending=None
+        # rows of the block being filled already written by SWMR flush, and when
+        self.rowFlushed,self.tFlushed=0,time.time()
+        self.closing=False
+        self.error=None
+        # statistics
+        self.rowsWritten=self.bytesWritten=0
+        self.writeTime=self.stallTime=0.
+        # time to write each block
+        self.writeLatency=vrmagicMetrics.Histogram()
+        self.t0=time.time()
+        self.cond=threading.Condition()
+        # the file is opened here, so that errors surface in the caller; it is then used (and closed) by the writer thread only
+        self.h5,self.dss=self._open()
+        self.thread=threading.Thread(target=self._run,daemon=True)
+        self.thread.start()
+        # a writer which is not closed explicitly is closed at exit, so that the block being filled is written and the file closed properly
+        atexit.register(self.close)
+    def append(self,**data):
+        '''
+        Append rows given as keyword arguments name=array (all quantities, with the same number of rows; 1d arrays are single rows).
+        '''
+        data={k:(v[None,:] if np.ndim(v)==1 else v) for k,v in data.items()}
+        n=len(next(iter(data.values())))
+        i=0
+        while i<n:
+            blk=self.blocks[self.fill]
+            m=min(n-i,self.chunkRows-self.row)
+            for name,_,_ in self.columns: blk[name][self.row:self.row+m]=data[name][i:i+m]
+            self.row+=m
+            i+=m
+            if self.row==self.chunkRows: self._submit()
+        if self.swmr and self.row>self.rowFlushed and time.time()-self.tFlushed>=self.flushInterval: self._submitPartial()
+    def appendFrames(self,C,A,I,footer):
+        'Append decoded frames (as returned by VRMagicTransformer.payloads2arrays or FrameRing.peek) to datasets created by frameColumns.'
+        self.append(**frameData(C,A,I,footer,raw=self.raw))
+    def appendCompressed(self,rows,chunks):
+        '''
+        Append *rows* rows given as one pre-compressed chunk per dataset (*chunks* maps names to compressed data of *chunkRows* rows, zero-padded beyond *rows*; see compressChunk and vrmagicPool.DecodePool), which are written directly. Datasets must be chunk-aligned: rows appended before must have come in whole chunks.
+        '''
+        if self.compression!='gzip': raise ValueError("Pre-compressed chunks require compression='gzip'.")
+        if self.row>0: raise ValueError('Pre-compressed chunks cannot follow %d rows appended uncompressed (not chunk-aligned).'%self.row)
+        self._submit(rows=rows,comp=[chunks[name] for name,_,_ in self.columns])
+    def flush(self):
+        'Hand the partially filled block to the writer and wait until everything is written.'
+        if self.row>0: self._submit()
+        with self.cond: self.cond.wait_for(lambda: self.pending is None or self.error)
+        self._checkError()
+    def close(self):
+        'Write outstanding data, stop the writer thread and close the file; does nothing if already closed.'
+        atexit.unregister(self.close)
+        if self.closing: return
+        # the file is closed (by the writer thread) also if writing outstanding data fails
+        try: self.flush()
+        finally:
+            with self.cond:
+                self.closing=True
+                self.cond.notify_all()
+            self.thread.join()
+            if self.pool: self.pool.shutdown()
+        self._checkError()
+    def __enter__(self): return self
+    def __exit__(self,*args): self.close()
+    def stats(self):
+        '''
+        Return dict with write statistics: rows and (uncompressed) bytes written, throughput in rows/s and MB/s since start, time spent writing and time the caller was stalled waiting for the writer, and backlog in rows (handed over but not yet written, plus rows in the block being filled).
+        '''
+        dt=time.time()-self.t0
+        with self.cond: pending=self.pending[1] if self.pending and not self.pending[4] else 0
+        return dict(rows=self.rowsWritten,bytes=self.bytesWritten,rowsPerSec=self.rowsWritten/dt,MBPerSec=self.bytesWritten/dt/1e6,writeTime=self.writeTime,stallTime=self.stallTime,backlog=pending+self.row)
+    def metrics(self):
+        'Return (scalars,histograms) for vrmagicMetrics.MetricsExporter: stats() and block write latency.'
+        return self.stats(),dict(write_seconds=self.writeLatency)
+    def _checkError(self):
+        if self.error: raise RuntimeError('HDF5 writer thread failed.') from self.error
+    def _submit(self,rows=None,comp=None):
+        'Hand the block being filled to the writer thread; or, with *comp*, *rows* rows as pre-compressed chunks.'
+        t0=time.time()
+        with self.cond:
+            self.cond.wait_for(lambda: self.pending is None or self.error)
+            self._checkError()
+            self.pending=(self.blocks[self.fill],self.row,None,self.rowsQueued,False) if comp is None else (None,rows,comp,self.rowsQueued,False)
+            self.cond.notify_all()
+        self.stallTime+=time.time()-t0
+        self.rowsQueued+=self.row if comp is None else rows
+        if comp is None: self.fill,self.row=1-self.fill,0
+        self.rowFlushed,self.tFlushed=0,time.time()
+    def _submitPartial(self):
+        'Hand a copy of rows of the block being filled to the writer thread, unless it is busy.'
+        with self.cond:
+            if self.pending is not None: return
+            self._checkError()
+            blk=self.blocks[self.fill]
+            self.pending=({name:blk[name][:self.row].copy() for name,_,_ in self.columns},self.row,None,self.rowsQueued,True)
+            self.cond.notify_all()
+        self.rowFlushed,self.tFlushed=self.row,time.time()
+    def _compress(self,arr): return compressChunk(arr,self.compressionOpts,self.shuffle)
+    def _open(self):
+        'Open the file, create datasets (or use existing ones) and switch to SWMR mode (with *swmr*); return (file,datasets).'
+        h5=h5py.File(self.h5name,self.mode,**(dict(libver='latest') if self.swmr else {}))
+        try:
+            grp=h5.require_group(self.h5root)
+            dss=[]
+            for name,cols,dtype in self.columns:
+                if name in grp: dss.append(grp[name])
+                else: dss.append(grp.create_dataset(name,(0,cols),maxshape=(None,cols),dtype=dtype,chunks=(self.chunkRows,cols),compression=self.compression,compression_opts=self.compressionOpts,shuffle=self.shuffle))
+                dss[-1].attrs.update(self.attrs.get(name,{}))
+            if self.swmr:
+                try: h5.swmr_mode=True
+                except RuntimeError as e: raise RuntimeError('Cannot write %s in SWMR mode: it must be a new file, or one written in SWMR mode before.'%self.h5name) from e
+        except Exception:
+            h5.close()
+            raise
+        return h5,dss
+    def _run(self):
+        try:
+            with self.h5 as h5:
+                dss=self.dss
+                # rows present before
+                base=dss[0].shape[0]
+                while True:
+                    with self.cond:
+                        self.cond.wait_for(lambda: self.pending is not None or self.closing)
+                        if self.pending is None: return
+                        blk,rows,comp,start,partial=self.pending
+                    t0=time.time()
+                    r0=base+start
+                    if comp is not None and r0%self.chunkRows: raise ValueError('Pre-compressed chunk appended at row %d, which is not chunk-aligned.'%r0)
+                    # direct chunk writes only for full, chunk-aligned blocks
+                    if comp is None and self.pool and rows==self.chunkRows and r0%self.chunkRows==0 and not partial:
+                        # the pool refuses work once the interpreter is shutting down (close called at exit): use the filter pipeline then
+                        try: comp=list(self.pool.map(self._compress,[blk[name] for name,_,_ in self.columns]))
+                        except RuntimeError: comp=None
+                    for i,(ds,(name,cols,dtype)) in enumerate(zip(dss,self.columns)):
+                        # rows of a partially written block are written again when it is complete
+                        if ds.shape[0]<r0+rows: ds.resize((r0+rows,ds.shape[1]))
+                        if comp is not None: ds.id.write_direct_chunk((r0,0),comp[i])
+                        else: ds[r0:r0+rows]=blk[name][:rows]
+                        if not partial: self.bytesWritten+=rows*cols*dtype.itemsize
+                    h5.flush()
+                    self.writeTime+=time.time()-t0
+                    if not partial: self.writeLatency.observe(time.time()-t0)
+                    with self.cond:
+                        if not partial: self.rowsWritten+=rows
+                        self.pending=None
+                        self.cond.notify_all()
+        except Exception as e:
+            with self.cond:
+                self.error=e
+                self.cond.notify_all()
@@ -0,0 +1,162 @@
+import numpy as np
+import time
+
+import vrmagicH5Writer, vrmagicMetrics
+
+
+def resampleRows(A,C,I,xGrid,maxGap=None,invalid=None):
+    '''
+    Resample N profiles (x coordinates *A*, z coordinates *C* and intensity *I*, all (N,W), as decoded by VRMagicTransformer) onto common ascending *xGrid* by linear interpolation between neighbouring valid points of each profile, for all profiles at once; return (Z,Ig) of shape (N,len(xGrid)): float32 z (nan where there is no data) and uint16 intensity (0 where there is no data).
+
+    Grid points outside of valid data of the profile, or between valid points more than *maxGap* apart (by default 4 grid steps, so that holes in the profile are not bridged), have no data. Coordinates equal to *invalid* (for integer coordinate types such as int32um) are invalid, as are nan's.
+    '''
+    # float coordinates are resampled in their own precision (at least float32), integer ones in float64
+    dtype=np.result_type(A.dtype,np.float32) if A.dtype.kind=='f' else np.dtype('float64')
+    xGrid=np.asarray(xGrid,dtype=dtype)
+    if maxGap is None: maxGap=4*np.median(np.diff(xGrid)) if len(xGrid)>1 else np.inf
+    N,W=A.shape
+    G=len(xGrid)
+    valid=(A!=invalid)&(C!=invalid) if invalid is not None else ~(np.isnan(A)|np.isnan(C))
+    nValid=valid.sum(axis=1)
+    if N==0 or not nValid.any(): return np.full((N,G),np.nan,dtype='float32'),np.zeros((N,G),dtype='uint16')
+    # valid points of all profiles, in row-major order (so each profile's points are contiguous)
+    rowIx=np.nonzero(valid)[0]
+    Xv,Zv,Iv=A[valid].astype(dtype),C[valid].astype(dtype),I[valid].astype(dtype)
+    # profiles are usually ordered by x already; otherwise sort them (one sort for all, with each profile shifted to its own interval)
+    if np.any((Xv[1:]<Xv[:-1])&(rowIx[1:]==rowIx[:-1])):
+        o=np.argsort(rowIx*(2*(np.abs(Xv).max()+1.))+Xv,kind='stable')
+        Xv,Zv,Iv=Xv[o],Zv[o],Iv[o]
+    # left neighbour of each grid point: the row's points not right of it are counted with a cumulative histogram of grid positions of the points (no search over all points)
+    rowStart=np.concatenate([[0],np.cumsum(nValid)[:-1]])
+    last=rowStart+nValid-1
+    cnt=np.bincount(rowIx*(G+1)+np.searchsorted(xGrid,Xv,side='left'),minlength=N*(G+1)).reshape(N,G+1).cumsum(axis=1)[:,:G]
+    j=rowStart[:,None]-1+cnt
+    jr=np.minimum(j+1,len(Xv)-1)
+    # distance to the next point of the same profile (0 for the last one, where only a grid point equal to it has data)
+    gap=np.append(np.diff(Xv),Xv.dtype.type(0))
+    gap[last[nValid>0]]=0
+    dx=gap[j]
+    xl=Xv[j]
+    ok=(cnt>=1)&((cnt<nValid[:,None])|(Xv[np.maximum(last,0)][:,None]==xGrid))&(dx<=maxGap)
+    with np.errstate(invalid='ignore',divide='ignore'): t=np.where(dx>0,(xGrid-xl)/dx,0)
+    zl,il=Zv[j],Iv[j]
+    Zg=np.where(ok,zl+t*(Zv[jr]-zl),np.nan).astype('float32')
+    Ig=np.where(ok,np.rint(il+t*(Iv[jr]-il)),0).astype('uint16')
+    return Zg,Ig
+
+
+def pointCloud(C,A,y,invalid=None):
+    '''
+    Return (M,3) float64 array of (x,y,z) of all valid points of N profiles (*C*, *A* as decoded by VRMagicTransformer), where *y* (N values) is the position of each profile along the direction of motion (e.g. HeightMap.positions); no resampling is done.
+    '''
+    X,Z=A.astype('float64'),C.astype('float64')
+    if invalid is not None: X[A==invalid]=np.nan; Z[C==invalid]=np.nan
+    valid=~(np.isnan(X)|np.isnan(Z))
+    Y=np.broadcast_to(np.asarray(y,dtype='float64')[:,None],X.shape)
+    return np.stack([X[valid],Y[valid],Z[valid]],axis=1)
+
+
+class HeightMap:
+    '''
+    Streaming height map: profiles are resampled onto fixed *xGrid* (see resampleRows) and placed into rows *dy* apart, by position along the direction of motion — encoder position from the footer times *encoderScale* (*by*='encoder'; the 32-bit counter may wrap around) or timestamp times *speed* (*by*='timestamp'), relative to the first frame. Profiles falling onto the same row are averaged (per column, over valid values), rows which no profile fell onto are nan; profiles going back to rows already emitted (e.g. the conveyor reversing) are dropped and counted.
+
+    Batches are passed to process(); the last row stays open until a profile with a higher row arrives (or close() is called). Finished rows are kept in memory (*keep*, see surface()) and/or appended to *h5name* under *h5root* through vrmagicH5Writer.H5Writer, in tiles of *tileRows* rows spanning the whole grid (datasets z, intensity and y, with x0, dx, dy and by as attributes of z; *writerKw* are passed to H5Writer).
+
+    Frames must be transformed (not raw); with *invalid* (VRMagicTransformer.coordInvalid for int32um), integer invalid coordinates are recognized.
+    '''
+    def __init__(self,xGrid,dy,by='encoder',encoderScale=1.,speed=None,maxGap=None,invalid=None,keep=True,h5name=None,h5root='heightmap',tileRows=256,**writerKw):
+        if by not in ('encoder','timestamp'): raise ValueError("*by* must be 'encoder' or 'timestamp' (not %s)."%by)
+        if by=='timestamp' and speed is None: raise ValueError("*speed* must be given with by='timestamp'.")
+        self.xGrid=np.asarray(xGrid,dtype='float64')
+        self.dy,self.by,self.encoderScale,self.speed,self.maxGap,self.invalid,self.keep=dy,by,encoderScale,speed,maxGap,invalid,keep
+        G=len(self.xGrid)
+        # first raw position (encoder or timestamp), last encoder value and its unwrapped value
+        self.pos0=self.encPrev=None
+        self.encAbs=0
+        # open row: its index and per-column sums and counts of valid values
+        self.openRow=None
+        self.sumZ,self.sumI,self.cnt=np.zeros(G),np.zeros(G),np.zeros(G,dtype='int64')
+        self.rows,self.parts=0,[]
+        self.frames=self.backwards=0
+        self.processLatency=vrmagicMetrics.Histogram()
+        self.writer=None
+        if h5name:
+            dx=float(np.median(np.diff(self.xGrid))) if G>1 else 0.
+            self.writer=vrmagicH5Writer.H5Writer(h5name,h5root,[('z',G,'float32'),('intensity',G,'uint16'),('y',1,'float64')],chunkRows=tileRows,attrs=dict(z=dict(x0=self.xGrid[0],dx=dx,dy=dy,by=by)),**writerKw)
+    def positions(self,footer):
+        'Return position of N frames (float64, relative to the first frame ever processed) along the direction of motion, from their footers; updates encoder unwrapping state, call once per batch.'
+        if self.by=='timestamp':
+            t=footer['timestamp'].astype('float64')
+            if self.pos0 is None and len(t): self.pos0=t[0]
+            return self.speed*(t-self.pos0)
+        enc=footer['encoderPosition'].astype('int64')
+        if len(enc)==0: return np.zeros(0)
+        if self.encPrev is None: self.encPrev=enc[0]
+        # signed modular difference to the previous value, so that wrap-around of the counter is transparent
+        d=(np.diff(np.concatenate([[self.encPrev],enc]))+2**31)%2**32-2**31
+        absPos=self.encAbs+np.cumsum(d)
+        self.encPrev,self.encAbs=enc[-1],absPos[-1]
+        return self.encoderScale*absPos
+    def process(self,C,A,I,footer):
+        'Add batch of N frames (transformed, as returned by Acquisition batches or VRMagicTransformer.payloads2arrays); emit rows which are complete.'
+        t0=time.perf_counter()
+        N=len(footer)
+        if N==0: return
+        self.frames+=N
+        ri=np.rint(self.positions(footer)/self.dy).astype('int64')
+        # profiles behind the furthest row seen so far are dropped
+        start=ri[0] if self.openRow is None else self.openRow
+        fwd=ri>=np.maximum.accumulate(np.concatenate([[start],ri[:-1]]))
+        self.backwards+=N-int(fwd.sum())
+        if not fwd.all(): C,A,I,ri=C[fwd],A[fwd],I[fwd],ri[fwd]
+        if len(ri)==0: return
+        Zg,Ig=resampleRows(A,C,I,self.xGrid,maxGap=self.maxGap,invalid=self.invalid)
+        valid=~np.isnan(Zg)
+        # sum up profiles of the same row (rows are non-decreasing now)
+        starts=np.flatnonzero(np.concatenate([[True],ri[1:]!=ri[:-1]]))
+        rowNo=ri[starts]
+        sumZ=np.add.reduceat(np.where(valid,Zg,0.).astype('float64'),starts,axis=0)
+        sumI=np.add.reduceat(np.where(valid,Ig,0).astype('float64'),starts,axis=0)
+        cnt=np.add.reduceat(valid.astype('int64'),starts,axis=0)
+        if self.openRow is None: self.openRow=rowNo[0]
+        if rowNo[0]==self.openRow:
+            sumZ[0]+=self.sumZ; sumI[0]+=self.sumI; cnt[0]+=self.cnt
+        else:
+            rowNo,sumZ,sumI,cnt=np.concatenate([[self.openRow],rowNo]),np.concatenate([self.sumZ[None],sumZ]),np.concatenate([self.sumI[None],sumI]),np.concatenate([self.cnt[None],cnt])
+        # the last row stays open
+        self.openRow,self.sumZ,self.sumI,self.cnt=rowNo[-1],sumZ[-1],sumI[-1],cnt[-1]
+        if len(rowNo)>1: self._emit(rowNo[:-1],sumZ[:-1],sumI[:-1],cnt[:-1],rowNo[-1])
+        self.processLatency.observe(time.perf_counter()-t0)
+    def _emit(self,rowNo,sumZ,sumI,cnt,end):
+        'Emit rows from rowNo[0] up to (excluding) *end*, with averaged data for *rowNo* and no data elsewhere.'
+        n=end-rowNo[0]
+        G=len(self.xGrid)
+        Z,I=np.full((n,G),np.nan,dtype='float32'),np.zeros((n,G),dtype='uint16')
+        ix=rowNo-rowNo[0]
+        with np.errstate(invalid='ignore',divide='ignore'):
+            Z[ix]=np.where(cnt>0,sumZ/cnt,np.nan)
+            I[ix]=np.where(cnt>0,np.rint(sumI/np.maximum(cnt,1)),0)
+        y=(self.dy*np.arange(rowNo[0],end,dtype='float64'))[:,None]
+        self.rows+=int(n)
+        if self.keep: self.parts.append((Z,I,y[:,0]))
+        if self.writer: self.writer.append(z=Z,intensity=I,y=y)
+    def surface(self):
+        'Return (z,intensity,y) of all rows emitted so far (*keep* must be set): (rows,len(xGrid)) float32 and uint16 arrays, y of each row; x of each column is xGrid.'
+        if not self.keep: raise RuntimeError('Rows are not kept in memory (keep=False).')
+        if len(self.parts)>1: self.parts=[tuple(np.concatenate(p) for p in zip(*self.parts))]
+        if not self.parts: return np.zeros((0,len(self.xGrid)),dtype='float32'),np.zeros((0,len(self.xGrid)),dtype='uint16'),np.zeros(0)
+        return self.parts[0]
+    def close(self):
+        'Emit the open row and close the HDF5 writer (if any).'
+        if self.openRow is not None:
+            self._emit(np.array([self.openRow]),self.sumZ[None],self.sumI[None],self.cnt[None],self.openRow+1)
+            self.openRow=None
+        if self.writer: self.writer.close()
+    def __enter__(self): return self
+    def __exit__(self,*args): self.close()
+    def stats(self):
+        'Return dict with frames processed, rows emitted and frames dropped for going backwards.'
+        return dict(frames=self.frames,rows=self.rows,backwards=self.backwards)
+    def metrics(self):
+        'Return (scalars,histograms) for vrmagicMetrics.MetricsExporter: stats() and time to process each batch.'
+        return self.stats(),dict(process_seconds=self.processLatency)
@@ -0,0 +1,114 @@
+import numpy as np
+import matplotlib.pyplot as plt, matplotlib.animation
+
+
+class Waterfall:
+    '''
+    Preallocated ring of the last *rows* profiles (z and intensity), for scrolling time × column images. Every row is stored twice (at i and i+rows), so that the last *rows* rows are always a contiguous view, in time order, without copying. Only every *decimate*-th frame is stored.
+    '''
+    def __init__(self,rows,width,decimate=1):
+        self.rows,self.decimate=rows,decimate
+        self.z=np.full((2*rows,width),np.nan,dtype='float32')
+        self.intensity=np.zeros((2*rows,width),dtype='float32')
+        # index of the oldest row, frames seen so far
+        self.head=self.seen=0
+    def append(self,C,I):
+        'Append profiles *C* (z) and *I* (intensity), both (N,width).'
+        # frames to store (every decimate-th, counted across calls); only the last rows of them survive
+        first=(-self.seen)%self.decimate
+        self.seen+=len(C)
+        C,I=C[first::self.decimate],I[first::self.decimate]
+        n=len(C)
+        m=min(n,self.rows)
+        h=(self.head+n-m)%self.rows
+        # rows h…h+m are contiguous in the doubled array; the part below rows is mirrored rows further, the part above rows earlier
+        k,e=min(h+m,self.rows),max(h+m,self.rows)
+        for arr,X in ((self.z,C[n-m:]),(self.intensity,I[n-m:])):
+            arr[h:h+m]=X
+            arr[h+self.rows:k+self.rows]=arr[h:k]
+            arr[:e-self.rows]=arr[self.rows:e]
+        self.head=(self.head+n)%self.rows
+    def view(self):
+        'Return (z,intensity) views of the last *rows* rows, oldest first.'
+        return self.z[self.head:self.head+self.rows],self.intensity[self.head:self.head+self.rows]
+
+
+class LiveView:
+    '''
+    Live display of frames from *acq* (vrmagicAcquisition.Acquisition, running at full rate in its own thread): at most *fps* times per second, all frames which arrived since the last refresh are taken from the ring (and released right away), the latest one is shown as profile and all of them are added to waterfall images of z and intensity (*waterfall* rows, every *decimate*-th frame).
+
+    Only changed artists are redrawn (blitting); axis limits are fixed, so that no full redraw is needed: to *limits* ((xMin,xMax),(zMin,zMax)) if given, otherwise to the coordinate range of the AOI, as seen in the first frames (valid coordinates, with *margin* as fraction of the range added on both sides; the figure is redrawn once when they arrive). Frames from acquisition with raw coordinates are shown untransformed, in raw units.
+    '''
+    def __init__(self,acq,trsf,fps=25,waterfall=500,decimate=1,limits=None,margin=.05):
+        self.acq,self.trsf,self.fps,self.margin=acq,trsf,fps,margin
+        self.raw=acq.ring.raw
+        # integer coordinates (raw or int32um) are shown as float, with nan for invalid values
+        self.invalid=trsf.invalid if self.raw else (None if np.isnan(trsf.coordInvalid) else trsf.coordInvalid)
+        self.wf=Waterfall(waterfall,acq.ring.width,decimate=decimate)
+        self.frames=0
+        self.fig=plt.figure(figsize=(8,9))
+        axP=self.fig.add_subplot(3,1,1)
+        axZ,axI=self.fig.add_subplot(3,1,2),self.fig.add_subplot(3,1,3)
+        self.axP=axP
+        self.profile,=axP.plot([],[],'.',markersize=1,animated=True)
+        axP.grid(True)
+        self.text=axP.text(.01,.95,'',transform=axP.transAxes,va='top',animated=True)
+        z,i=self.wf.view()
+        self.imZ=axZ.imshow(z,aspect='auto',interpolation='nearest',animated=True)
+        self.imI=axI.imshow(i,aspect='auto',interpolation='nearest',vmin=0,vmax=1024,animated=True)
+        axZ.set_ylabel('z (time ↓)')
+        axI.set_ylabel('intensity (time ↓)')
+        axI.set_xlabel('column')
+        self.limits=None
+        if limits is not None: self._setLimits(limits)
+    def _setLimits(self,limits):
+        'Fix limits ((xMin,xMax),(zMin,zMax)) of the profile axes and of the z waterfall colour scale.'
+        self.limits=limits
+        (x0,x1),(z0,z1)=limits
+        self.axP.set_xlim(x0,x1)
+        self.axP.set_ylim(z1,z0)
+        self.imZ.set_clim(z0,z1)
+    def _limitsFromData(self,A,C):
+        'Limits spanning valid coordinates *A*, *C* (with margin), or None if there are none.'
+        if np.isnan(A).all() or np.isnan(C).all(): return None
+        ret=[]
+        for X in (A,C):
+            lo,hi=float(np.nanmin(X)),float(np.nanmax(X))
+            pad=self.margin*(hi-lo) or 1.
+            ret.append((lo-pad,hi+pad))
+        return ret
+    def _toFloat(self,X):
+        'Coordinates as float, with nan for invalid values.'
+        if self.invalid is None: return X
+        ret=X.astype('float32')
+        ret[X==self.invalid]=np.nan
+        return ret
+    def update(self,*args):
+        'Take all frames waiting in the ring and update artists; called by the animation timer.'
+        last=None
+        while True:
+            C,A,I,footer=self.acq.ring.peek()
+            if len(footer)==0: break
+            C,A=self._toFloat(C),self._toFloat(A)
+            if self.limits is None:
+                limits=self._limitsFromData(A,C)
+                if limits is not None:
+                    self._setLimits(limits)
+                    # ticks change: one full redraw, the animation then caches the new background
+                    self.fig.canvas.draw()
+            self.wf.append(C,I)
+            last=(A[-1].copy(),C[-1].copy(),footer[-1].copy())
+            self.frames+=len(footer)
+            self.acq.ring.release(len(footer))
+        if last is not None:
+            a,c,f=last
+            self.profile.set_data(a,c)
+            self.text.set_text('t=%.3f s, frame %d, %.0f fps, %d dropped'%(f['timestamp'],f['frameNo'],self.acq.stats()['fps'],self.acq.ring.dropped))
+            z,i=self.wf.view()
+            self.imZ.set_data(z)
+            self.imI.set_data(i)
+        return self.profile,self.text,self.imZ,self.imI
+    def show(self):
+        'Run the display (blocks until the window is closed).'
+        self.anim=matplotlib.animation.FuncAnimation(self.fig,self.update,interval=1000./self.fps,blit=True,cache_frame_data=False)
+        plt.show()
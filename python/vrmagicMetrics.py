@@ -0,0 +1,130 @@
+import numpy as np
+import threading, time, json, os, bisect, numbers
+
+
+def promValue(v):
+    'Format value *v* for Prometheus text format: integers (and bools) exactly, floats with full precision (so that large counters do not freeze).'
+    if isinstance(v,(numbers.Integral,np.bool_)): return '%d'%v
+    v=float(v)
+    if v!=v: return 'NaN'
+    if v in (float('inf'),float('-inf')): return '+Inf' if v>0 else '-Inf'
+    return repr(v)
+
+
+class Histogram:
+    '''
+    Histogram of latencies (in seconds) with fixed bucket upper bounds *edges*; cheap enough to be updated for every frame. Quantiles are estimated from bucket bounds (see quantile).
+    '''
+    # 10 µs … ~10 s, 4 buckets per decade
+    defaultEdges=[float('%.3g'%e) for e in 10**np.arange(-5,1.01,.25)]
+    def __init__(self,edges=None):
+        self.edges=list(edges or self.defaultEdges)
+        self.counts=[0]*(len(self.edges)+1)
+        self.count,self.sum,self.max=0,0.,0.
+    def observe(self,v):
+        'Add single value *v*.'
+        self.counts[bisect.bisect_left(self.edges,v)]+=1
+        self.count+=1
+        self.sum+=v
+        if v>self.max: self.max=v
+    def observeMany(self,vv):
+        'Add all values in array *vv*.'
+        vv=np.asarray(vv)
+        if vv.size==0: return
+        for i,n in enumerate(np.bincount(np.searchsorted(self.edges,vv),minlength=len(self.counts))): self.counts[i]+=int(n)
+        self.count+=vv.size
+        self.sum+=float(vv.sum())
+        self.max=max(self.max,float(vv.max()))
+    def quantile(self,q):
+        'Return estimate of *q*-quantile: interpolated linearly within the bucket containing it, and at most the largest value observed (nan if empty).'
+        if self.count==0: return float('nan')
+        cum=np.cumsum(self.counts).tolist()
+        r=q*self.count
+        i=bisect.bisect_left(cum,r)
+        if i>=len(self.edges): return self.max
+        lo=self.edges[i-1] if i else 0.
+        below=cum[i-1] if i else 0
+        return min(lo+(self.edges[i]-lo)*(r-below)/self.counts[i],self.max)
+    def summary(self):
+        'Return dict with count, mean, max and 50/90/99 % quantiles.'
+        return dict(count=self.count,mean=self.sum/self.count if self.count else float('nan'),max=self.max,p50=self.quantile(.5),p90=self.quantile(.9),p99=self.quantile(.99))
+    def prometheus(self,name):
+        'Return lines of Prometheus text format for histogram *name*.'
+        ret,cum=[],0
+        for e,n in zip(self.edges,self.counts):
+            cum+=n
+            ret.append('%s_bucket{le="%g"} %d'%(name,e,cum))
+        ret+=['%s_bucket{le="+Inf"} %d'%(name,self.count),'%s_sum %s'%(name,promValue(self.sum)),'%s_count %d'%(name,self.count)]
+        return ret
+
+
+class FrameGaps:
+    '''
+    Detect lost frames from gaps in footer frame counter and event number (modulo *frameNoMod* and *eventNoMod*: both are 16-bit counters on the sensor, which wrap around), frame by frame as they arrive. Frames which arrived but were deliberately not processed (e.g. dropped when the ring was full) must be reported through skip() (*n* at a time), so that they do not count as lost.
+    '''
+    def __init__(self,frameNoMod=2**16,eventNoMod=2**16):
+        self.frameNoMod,self.eventNoMod=frameNoMod,eventNoMod
+        self.lastFrameNo=self.lastEventNo=None
+        self.skipped=0
+        # frames lost (total of all gaps), number of gaps, counter jumps backwards (sensor restarted?)
+        self.lostFrames=self.lostEvents=self.gaps=self.resets=0
+    def skip(self,n=1): self.skipped+=n
+    def update(self,frameNo,eventNo):
+        if self.lastFrameNo is not None:
+            # a large forward distance (or none) is rather a jump backwards
+            f=(frameNo-self.lastFrameNo)%self.frameNoMod
+            if f==0 or f>=self.frameNoMod//2: self.resets+=1
+            elif f-1-self.skipped>0:
+                self.lostFrames+=f-1-self.skipped
+                self.gaps+=1
+            e=(eventNo-self.lastEventNo-1-self.skipped)%self.eventNoMod
+            if 0<e<self.eventNoMod//2: self.lostEvents+=e
+        self.lastFrameNo,self.lastEventNo,self.skipped=frameNo,eventNo,0
+    def metrics(self): return dict(lostFrames=self.lostFrames,lostEvents=self.lostEvents,gaps=self.gaps,resets=self.resets)
+
+
+class MetricsExporter:
+    '''
+    Periodically (every *interval* seconds, in a background thread) collect metrics from *sources* and append them as one JSON line to *jsonName* and/or write them to *promName* in Prometheus text format (replaced atomically, suitable for node_exporter's textfile collector).
+
+    *sources* maps names (used as prefixes) to objects with metrics() method, returning (dict of scalar values, dict of Histogram), such as vrmagicAcquisition.Acquisition or vrmagicH5Writer.H5Writer.
+    '''
+    def __init__(self,sources,interval=10.,jsonName=None,promName=None,prefix='vrmagic'):
+        self.sources,self.interval,self.jsonName,self.promName,self.prefix=sources,interval,jsonName,promName,prefix
+        self.stopEvent=threading.Event()
+        self.thread=threading.Thread(target=self._run,daemon=True)
+    def start(self): self.thread.start()
+    def stop(self):
+        self.stopEvent.set()
+        self.thread.join()
+        self.export()
+    def __enter__(self):
+        self.start()
+        return self
+    def __exit__(self,*args): self.stop()
+    def collect(self):
+        'Return dict of metrics from all sources (histograms as summaries), as written to the JSON file.'
+        ret=dict(time=time.time())
+        for name,src in self.sources.items():
+            scalars,hists=src.metrics()
+            ret[name]=dict(scalars,**{h:hist.summary() for h,hist in hists.items()})
+        return ret
+    def prometheus(self):
+        'Return metrics from all sources in Prometheus text format.'
+        lines=[]
+        for name,src in self.sources.items():
+            scalars,hists=src.metrics()
+            for k,v in scalars.items(): lines.append('%s_%s_%s %s'%(self.prefix,name,k,promValue(v)))
+            for k,h in hists.items():
+                lines.append('# TYPE %s_%s_%s histogram'%(self.prefix,name,k))
+                lines+=h.prometheus('%s_%s_%s'%(self.prefix,name,k))
+        return '\n'.join(lines)+'\n'
+    def export(self):
+        'Write metrics right now.'
+        if self.jsonName:
+            with open(self.jsonName,'a') as f: f.write(json.dumps(self.collect())+'\n')
+        if self.promName:
+            with open(self.promName+'.tmp','w') as f: f.write(self.prometheus())
+            os.replace(self.promName+'.tmp',self.promName)
+    def _run(self):
+        while not self.stopEvent.wait(self.interval): self.export()
@@ -0,0 +1,146 @@
+import numpy as np
+import multiprocessing, multiprocessing.shared_memory, collections, time
+
+import vrmagicTransformer, vrmagicH5Writer, vrmagicMetrics
+from vrmagicTransformer import footerDtype
+
+
+def sharedArrays(specs):
+    '''
+    Allocate arrays described by *specs* (sequence of (name,shape,dtype)) in one block of shared memory; return (SharedMemory,dict of arrays). Processes forked afterwards see the same memory.
+    '''
+    specs=[(name,shape,np.dtype(dtype)) for name,shape,dtype in specs]
+    # align each array to 64 bytes
+    offsets,size=[],0
+    for name,shape,dtype in specs:
+        offsets.append(size)
+        size+=-(-int(np.prod(shape))*dtype.itemsize//64)*64
+    shm=multiprocessing.shared_memory.SharedMemory(create=True,size=max(size,1))
+    return shm,{name:np.ndarray(shape,dtype=dtype,buffer=shm.buf,offset=off) for (name,shape,dtype),off in zip(specs,offsets)}
+
+
+class SharedPayloadRing(vrmagicTransformer.PayloadRing):
+    '''
+    PayloadRing (raw payloads, filled by vrmagicAcquisition.Acquisition without transformer) in shared memory, so that DecodePool workers read payloads without copying. For each stored payload, the number of frames dropped by the ring policy right before it is kept in *droppedBefore* (same slots), so that they are not taken for frames lost by the sensor. Call close() when done.
+    '''
+    def __init__(self,size,payloadSize,policy='dropNewest',blockTimeout=1.):
+        vrmagicTransformer.RingBase.__init__(self,size,policy=policy,blockTimeout=blockTimeout)
+        self.shm,arrs=sharedArrays([('payload',(size,payloadSize),np.uint8)])
+        self.payload=arrs['payload']
+        # only read in the consumer's process, need not be shared
+        self.droppedBefore=np.zeros(size,dtype='int64')
+        self.droppedStored=0
+    def push(self,data):
+        'See PayloadRing.push; also records frames dropped since the last stored one.'
+        i=self.reserve()
+        if i is None: return None
+        self.payload[i,:len(data)]=data
+        self.droppedBefore[i]=self.dropped-self.droppedStored
+        self.droppedStored=self.dropped
+        self.commit()
+        return i
+    def close(self):
+        'Release shared memory.'
+        del self.payload
+        self.shm.close()
+        self.shm.unlink()
+
+
+# state of worker processes, set by _workerInit
+_worker={}
+def _workerInit(trsf,payload,out,columns,compressionOpts,shuffle):
+    _worker.update(trsf=trsf,payload=payload,out=out,columns=columns,compressionOpts=compressionOpts,shuffle=shuffle)
+def _workerDecode(i0,i1,raw,block):
+    '''
+    Decode payload slots i0:i1 into shared output arrays (same slots); with compression, return compressed chunk (*block* rows, zero-padded) for each column. Returns (chunks or None,time spent).
+    '''
+    t0=time.perf_counter()
+    w=_worker
+    out=w['out']
+    C,A,I,F=w['trsf'].raw2arrays(w['payload'][i0:i1],out=(out['C'][i0:i1],out['A'][i0:i1],out['I'][i0:i1]),footer=out['footer'][i0:i1],transform=not raw)
+    chunks=None
+    if w['compressionOpts'] is not None:
+        data=vrmagicH5Writer.frameData(C,A,I,F,raw=raw)
+        chunks={}
+        for name,cols,dtype in w['columns']:
+            arr=np.ascontiguousarray(data[name],dtype=dtype)
+            if len(arr)<block: arr=np.concatenate([arr,np.zeros((block-len(arr),cols),dtype=dtype)])
+            chunks[name]=vrmagicH5Writer.compressChunk(arr,w['compressionOpts'],w['shuffle'])
+    return chunks,time.perf_counter()-t0
+
+
+class DecodePool:
+    '''
+    Decodes (and optionally compresses) frames from *ring* (SharedPayloadRing) in *workers* processes, so that decoding and compression are not limited by the GIL of the consumer's process. Blocks of *block* frames are dispatched as soon as they are complete and come back in frame order (see batches).
+
+    Decoded frames are written into shared arrays with the same slots as *ring* (*raw* keeps raw coordinates, see FrameRing); payload slots are released only once the consumer is done with the decoded block. With *compressionOpts* (gzip level), workers also compress each block into one HDF5 chunk per column of vrmagicH5Writer.frameColumns(…,raw), ready for H5Writer.appendCompressed (its *chunkRows* must be *block*, with the same *shuffle*).
+
+    Worker processes are forked when the pool is created, so create it before the Acquisition feeding *ring* (creating its stream starts Aravis' receive thread) and before H5Writer. Threads already running at that point (e.g. those Aravis.Camera.new starts for a GigE device) do not exist in the workers; this is safe because workers only decode with numpy and compress with zlib, and never call into Aravis or GLib (the transformer's device is not used for decoding). Call close() when done.
+    '''
+    def __init__(self,trsf,ring,workers=4,block=4096,raw=False,compressionOpts=None,shuffle=True):
+        if ring.size%block: raise ValueError('Ring size (%d) must be a multiple of block (%d).'%(ring.size,block))
+        # dropping the oldest frames would break blocks apart
+        if ring.policy=='dropOldest': raise ValueError("Ring policy 'dropOldest' is not supported, use 'dropNewest' or 'block'.")
+        self.trsf,self.ring,self.block,self.raw=trsf,ring,block,raw
+        cDtype='int16' if raw else trsf.coordDtype
+        self.shm,self.out=sharedArrays([('C',(ring.size,trsf.width),cDtype),('A',(ring.size,trsf.width),cDtype),('I',(ring.size,trsf.width),'uint16'),('footer',(ring.size,),footerDtype)])
+        columns=vrmagicH5Writer.frameColumns(trsf.width,raw=raw,coordDtype=trsf.coordDtype)
+        self.pool=multiprocessing.get_context('fork').Pool(workers,initializer=_workerInit,initargs=(trsf,ring.payload,self.out,columns,compressionOpts,shuffle))
+        # at most this many blocks in flight
+        self.maxPending=2*workers
+        # absolute index of the next frame to dispatch; blocks in flight as (i0,i1,AsyncResult), oldest first
+        self.dispatched=0
+        self.pending=collections.deque()
+        self.frames=0
+        # frames lost before reaching the ring (those dropped by the ring policy are reported as skipped, see SharedPayloadRing.droppedBefore)
+        self.gaps=vrmagicMetrics.FrameGaps()
+        self.blockLatency=vrmagicMetrics.Histogram()
+        self.t0=time.time()
+    def _dispatch(self,flush=False):
+        'Dispatch complete blocks (with *flush*, also the incomplete last one) waiting in the ring.'
+        ring=self.ring
+        while len(self.pending)<self.maxPending:
+            with ring.cond:
+                i0=self.dispatched%ring.size
+                n=min(ring.written-self.dispatched,self.block,ring.size-i0)
+                if n==0 or (n<self.block and not flush): return
+                self.dispatched+=n
+                ring.peeked=max(ring.peeked,self.dispatched)
+            self.pending.append((i0,i0+n,self.pool.apply_async(_workerDecode,(i0,i0+n,self.raw,self.block))))
+    def batches(self,isRunning,timeout=.1):
+        '''
+        Yield ((C,A,I,footer),chunks) for decoded blocks in frame order, until isRunning() returns False and the ring is drained; frames are views of shared arrays, valid until the next block is requested, chunks is dict of compressed chunks (None without compression).
+        '''
+        ring=self.ring
+        while True:
+            running=isRunning()
+            self._dispatch(flush=not running)
+            if not self.pending:
+                if not running: return
+                with ring.cond: ring.cond.wait_for(lambda: ring.written-self.dispatched>=self.block,timeout=timeout)
+                continue
+            i0,i1,res=self.pending.popleft()
+            chunks,dt=res.get()
+            self.blockLatency.observe(dt)
+            self.frames+=i1-i0
+            footer=self.out['footer'][i0:i1]
+            for frameNo,eventNo,dropped in zip(footer['frameNo'].tolist(),footer['eventNo'].tolist(),ring.droppedBefore[i0:i1].tolist()):
+                self.gaps.skip(dropped)
+                self.gaps.update(frameNo,eventNo)
+            try: yield (self.out['C'][i0:i1],self.out['A'][i0:i1],self.out['I'][i0:i1],footer),chunks
+            finally: ring.release(i1-i0)
+    def stats(self):
+        'Return dict with frames decoded, blocks in flight and average frames/s since start.'
+        return dict(frames=self.frames,inFlight=len(self.pending),fps=self.frames/(time.time()-self.t0))
+    def metrics(self):
+        'Return (scalars,histograms) for vrmagicMetrics.MetricsExporter: stats(), frame-loss counters from footer gaps and time to decode (and compress) each block in a worker.'
+        return dict(self.stats(),**self.gaps.metrics()),dict(block_seconds=self.blockLatency)
+    def close(self):
+        'Stop worker processes and release shared memory.'
+        self.pool.terminate()
+        self.pool.join()
+        self.out=None
+        self.shm.close()
+        self.shm.unlink()
+    def __enter__(self): return self
+    def __exit__(self,*args): self.close()
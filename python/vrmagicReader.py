@@ -0,0 +1,95 @@
+import numpy as np, h5py
+import time
+import vrmagicTransformer
+from vrmagicTransformer import footerDtype
+
+
+class DumpReader:
+    '''
+    Lazy access to frames in a HDF5 dump (written by vrmagicH5Writer.H5Writer); only the requested frames are read from the file.
+
+    Raw dumps (c16, a16, i16 and footer fields, see vrmagicH5Writer.frameColumns) are transformed to physical coordinates on access, using constants stored in dataset attributes; dumps of transformed data (z, x, intensity, timestamp) are returned as stored.
+
+    Frames are accessed by index (reader[i], reader[i:j:k]) or by timestamp (timeRange), each returning (C,A,I,footer) like VRMagicTransformer.payloads2arrays; iterChunks walks over a range of frames chunk by chunk, without holding more than one chunk in memory.
+
+    With *swmr*, a dump which is still being written (vrmagicH5Writer.H5Writer with *swmr*) is opened as SWMR reader; tail follows frames as they are appended.
+    '''
+    def __init__(self,h5name,h5root=None,coordDtype='float32',swmr=False):
+        '''
+        Open dump group *h5root* in *h5name*; if not given, the last (newest) dump-* group is used. Raw data are transformed to *coordDtype* (see vrmagicTransformer.coordDtypes).
+        '''
+        self.swmr=swmr
+        self.h5=h5py.File(h5name,'r',libver='latest',swmr=True) if swmr else h5py.File(h5name,'r')
+        if h5root is None: h5root=sorted(k for k in self.h5.keys() if k.startswith('dump-'))[-1]
+        self.grp=self.h5[h5root]
+        self.raw='c16' in self.grp
+        if self.raw:
+            self.C,self.A,self.I=self.grp['c16'],self.grp['a16'],self.grp['i16']
+            self.lutC,self.lutA=[vrmagicTransformer.makeLUT(ds.attrs['scale'],ds.attrs['offset'],ds.attrs['invalid'],coordDtype) for ds in (self.C,self.A)]
+        else: self.C,self.A,self.I=self.grp['z'],self.grp['x'],self.grp['intensity']
+        self.width=self.C.shape[1]
+        # all datasets read by read(); frames are those present in all of them (a writer extends them one by one)
+        self.datasets=[self.C,self.A,self.I]+[self.grp[f] for f in footerDtype.names if f in self.grp]
+        self.frames=min(ds.shape[0] for ds in self.datasets)
+        # timestamps are only read when first needed (timeRange)
+        self._timestamps=None
+    def __len__(self): return self.frames
+    def refresh(self):
+        'Update the number of frames from the file (only metadata are read; SWMR mode); return it.'
+        if self.swmr:
+            for ds in self.datasets: ds.refresh()
+        n=min(ds.shape[0] for ds in self.datasets)
+        if n!=self.frames: self.frames,self._timestamps=n,None
+        return n
+    def tail(self,start=None,rows=None,poll=.1,timeout=None):
+        '''
+        Yield (C,A,I,footer) of frames as they are appended to the dump, from *start* (by default, frames already present are skipped), at most *rows* frames at a time. Only new frames are read: the number of frames is polled every *poll* seconds (see refresh). Ends after *timeout* seconds without new frames (never if None).
+        '''
+        pos=self.refresh() if start is None else start
+        t0=time.time()
+        while True:
+            n=self.refresh()
+            if n>pos:
+                stop=n if rows is None else min(n,pos+rows)
+                yield self.read(pos,stop)
+                pos=stop
+                t0=time.time()
+                continue
+            if timeout is not None and time.time()-t0>=timeout: return
+            time.sleep(poll)
+    def close(self): self.h5.close()
+    def __enter__(self): return self
+    def __exit__(self,*args): self.close()
+    def __getitem__(self,ix):
+        if isinstance(ix,slice): return self.read(*ix.indices(len(self)))
+        if ix<0: ix+=len(self)
+        if not 0<=ix<len(self): raise IndexError('Frame index %d out of range (%d frames).'%(ix,len(self)))
+        return self.read(ix,ix+1)
+    def read(self,start,stop,step=1):
+        'Return (C,A,I,footer) for frames start:stop:step.'
+        sl=slice(start,stop,step)
+        C,A,I=self.C[sl],self.A[sl],self.I[sl]
+        if self.raw: C,A=self.lutC[C.view('uint16')],self.lutA[A.view('uint16')]
+        footer=np.zeros(len(I),dtype=footerDtype)
+        for f in footerDtype.names:
+            if f in self.grp: footer[f]=self.grp[f][sl,0]
+        return C,A,I,footer
+    def iterChunks(self,start=0,stop=None,rows=None):
+        '''
+        Yield (C,A,I,footer) for consecutive blocks of frames between *start* and *stop*, *rows* frames at a time (by default, the HDF5 chunk size, so that each chunk is decompressed only once).
+        '''
+        if stop is None: stop=len(self)
+        if rows is None: rows=self.C.chunks[0] if self.C.chunks else 4096
+        for i in range(start,stop,rows): yield self.read(i,min(i+rows,stop))
+    def timestamps(self):
+        'Return timestamps of all frames (read once, then cached).'
+        if self._timestamps is None: self._timestamps=self.grp['timestamp'][:,0]
+        return self._timestamps
+    def timeSlice(self,t0,t1):
+        'Return slice of frames with timestamps in [t0,t1).'
+        ts=self.timestamps()
+        return slice(*np.searchsorted(ts,[t0,t1]))
+    def timeRange(self,t0,t1):
+        'Return (C,A,I,footer) of frames with timestamps in [t0,t1).'
+        sl=self.timeSlice(t0,t1)
+        return self.read(sl.start,sl.stop)
@@ -0,0 +1,170 @@
+import numpy as np
+
+import vrmagicTransformer, vrmagicReader
+
+
+class SimDevice:
+    '''
+    Stand-in for the device of a VRMagic sensor: holds the features VRMagicTransformer reads and writes (values are plausible, not authoritative). Payload layout (PROFILE_COORD16: c16, a16, i16 blocks and footer) follows AOIWidth whenever it is set.
+    '''
+    def __init__(self,widthMax=2048,heightMax=1088,footerLen=64):
+        self.footerLen=footerLen
+        self.feats=dict(FooterTimestampTickFrequency=1000000000,IntraFooterStartOfExposureTimestampByteOffset=0,Scan3dInvalidDataValue=-32768,IntraFooterTriggerPipelineNumberByteOffset=20,IntraFooterMDBDeviceIDByteOffset=18,IntraFooterEventNumberByteOffset=16,IntraFooterFrameCounterByteOffset=8,IntraFooterEncoderPositionByteOffset=24,Scan3dCoordinateAScale_Numerator=1,Scan3dCoordinateAScale_Denominator=1000,Scan3dCoordinateAOffset_Numerator=-50,Scan3dCoordinateAOffset_Denominator=1,Scan3dCoordinateCScale_Numerator=1,Scan3dCoordinateCScale_Denominator=2000,Scan3dCoordinateCOffset_Numerator=-10,Scan3dCoordinateCOffset_Denominator=1,HeightMax=heightMax,WidthMax=widthMax,AOIHeight=heightMax,AOIWidth=widthMax,AOIOffsetX=0,AOIOffsetY=0,ImageHeight=1,AcquisitionFrameRate_mHz=1000000)
+        self.bools={}
+        self.layout()
+    def layout(self):
+        'Recompute payload layout from AOIWidth.'
+        w2=2*self.feats['AOIWidth']
+        self.feats.update(CoordCDataByteOffset=0,CoordADataByteOffset=w2,IntensityDataByteOffset=2*w2,FooterDataByteOffset=3*w2)
+        # frame rate limited by the number of sensor rows read out
+        self.feats['AcquisitionFrameRateMax_mHz']=int(1e3*min(10000,3.4e6/self.feats['AOIHeight']))
+    def payloadSize(self): return self.feats['FooterDataByteOffset']+self.footerLen
+    def get_feature(self,name): return name if name in self.feats else None
+    def get_integer_feature_value(self,name): return self.feats[name]
+    def set_integer_feature_value(self,name,val):
+        self.feats[name]=val
+        if name in ('AOIWidth','AOIHeight'): self.layout()
+    def get_string_feature_value(self,name): return dict(DeviceFirmwareVersion='sim-1.0').get(name,'')
+    def set_string_feature_value(self,name,val): pass
+    def get_boolean_feature_value(self,name): return self.bools.get(name,False)
+    def set_boolean_feature_value(self,name,val): self.bools[name]=val
+
+
+class SimCamera:
+    '''
+    Simulated VRMagic sensor, usable in place of Aravis.Camera by VRMagicTransformer and vrmagicAcquisition.SimAcquisition (no Aravis needed for the former). It produces byte-exact PROFILE_COORD16 payloads: c16, a16 and i16 blocks (with *invalidFraction* of columns set to the invalid value) and footer with timestamp, frame counter (16 bits, wrapping around like on the device), event number and multi-device bus id at the offsets the device reports.
+
+    The profile is a slow wave, with a part (raised by about 4 mm over the middle half of columns) passing under the sensor for *partLen* frames out of every *partEvery*, so that triggers have something to act upon.
+
+    Frames come at the frame rate set on the device (AcquisitionFrameRate_mHz, see VRMagicTransformer *fps*); exposure timestamps have gaussian *jitter* (in seconds); each frame is lost (never delivered) with probability *loss*. Event numbers start at *evNo0* and follow frame numbers modulo 2^16, so that cameras created with the same *evNo0* (see simCameras) behave like sensors synchronized through the multi-device bus (*mdbId* being the bus id). Encoder position starts at *encoder0* and advances by *encoderPerFrame* counts per frame (modulo 2^32), as with constant conveyor speed.
+    '''
+    def __init__(self,fps=None,jitter=0.,loss=0.,invalidFraction=.05,partEvery=2000,partLen=500,evNo0=0,mdbId=0,encoder0=0,encoderPerFrame=10,seed=0,**devKw):
+        self.dev=SimDevice(**devKw)
+        if fps is not None: self.dev.set_integer_feature_value('AcquisitionFrameRate_mHz',int(round(1000*fps)))
+        self.jitter,self.loss,self.invalidFraction,self.partEvery,self.partLen,self.evNo0,self.mdbId=jitter,loss,invalidFraction,partEvery,partLen,evNo0,mdbId
+        self.encoder0,self.encoderPerFrame=encoder0,encoderPerFrame
+        self.rng=np.random.default_rng(seed)
+        # number of the next frame to be scheduled, frames lost so far
+        self.nextFrameNo=0
+        self.lost=0
+    def get_device(self): return self.dev
+    def get_device_id(self): return 'Sim-SIM%04d'%self.mdbId
+    def get_payload(self): return self.dev.payloadSize()
+    def start_acquisition(self): pass
+    def stop_acquisition(self): pass
+    def fps(self): return self.dev.get_integer_feature_value('AcquisitionFrameRate_mHz')/1000.
+    def schedule(self,n):
+        '''
+        Return (frameNos,times) of the next frames delivered out of *n* acquired (lost ones are left out); *times* are nominal times of their exposure since the start of acquisition.
+        '''
+        frameNos=np.arange(self.nextFrameNo,self.nextFrameNo+n)
+        self.nextFrameNo+=n
+        if self.loss>0:
+            keep=self.rng.random(n)>=self.loss
+            self.lost+=n-keep.sum()
+            frameNos=frameNos[keep]
+        return frameNos,frameNos/self.fps()
+    def timestamps(self,frameNos):
+        'Exposure timestamps (in seconds) of *frameNos*, with jitter.'
+        t=np.asarray(frameNos)/self.fps()
+        if self.jitter>0: t=t+self.rng.normal(0,self.jitter,len(t))
+        return np.maximum(t,0)
+    def data(self,frameNos):
+        'Return (c16,a16,i16) raw data of *frameNos* as (N,width) arrays.'
+        f=self.dev.feats
+        frameNos=np.asarray(frameNos)
+        N,w,x0=len(frameNos),f['AOIWidth'],f['AOIOffsetX']
+        col=np.arange(x0,x0+w)/f['WidthMax']
+        c=8000+500*np.sin(2*np.pi*(3*col[None,:]+frameNos[:,None]/1000.))
+        part=((frameNos%self.partEvery)<self.partLen)[:,None]&((col>.25)&(col<.75))[None,:]
+        c16=(c+8000*part).astype('int16')
+        a16=np.broadcast_to(np.linspace(-30000,30000,f['WidthMax'])[x0:x0+w].astype('int16'),(N,w)).copy()
+        i16=self.rng.integers(200,300,size=(N,w),dtype='uint16')
+        invalid=self.rng.random((N,w))<self.invalidFraction
+        c16[invalid]=a16[invalid]=f['Scan3dInvalidDataValue']
+        i16[invalid]=0
+        return c16,a16,i16
+    def footers(self,frameNos,timestamps,eventNos=None,triggerIds=None,encoderPositions=None):
+        'Return (N,footerLen) uint8 array of raw footers.'
+        f=self.dev.feats
+        frameNos=np.asarray(frameNos)
+        fields=[('tick','<u8',f['IntraFooterStartOfExposureTimestampByteOffset']),('frameNo','<u2',f['IntraFooterFrameCounterByteOffset']),('eventNo','<u2',f['IntraFooterEventNumberByteOffset']),('multiDeviceBusId','<u2',f['IntraFooterMDBDeviceIDByteOffset']),('triggerId','<u2',f['IntraFooterTriggerPipelineNumberByteOffset']),('encoderPosition','<u4',f['IntraFooterEncoderPositionByteOffset'])]
+        names,formats,offsets=zip(*fields)
+        ret=np.zeros(len(frameNos),dtype=np.dtype(dict(names=names,formats=formats,offsets=offsets,itemsize=self.dev.footerLen)))
+        ret['tick']=np.round(np.asarray(timestamps)*f['FooterTimestampTickFrequency'])
+        ret['frameNo']=frameNos%2**16
+        ret['eventNo']=(self.evNo0+frameNos)%2**16 if eventNos is None else eventNos
+        ret['multiDeviceBusId']=self.mdbId
+        if triggerIds is not None: ret['triggerId']=triggerIds
+        ret['encoderPosition']=(self.encoder0+self.encoderPerFrame*frameNos)%2**32 if encoderPositions is None else encoderPositions
+        return ret.view(np.uint8).reshape(len(frameNos),-1)
+    def payloads(self,frameNos):
+        'Return (N,payloadSize) uint8 array of payloads of *frameNos*, laid out as the device reports.'
+        f=self.dev.feats
+        N=len(frameNos)
+        ret=np.zeros((N,self.get_payload()),dtype=np.uint8)
+        w2=2*f['AOIWidth']
+        for off,d in zip([f['CoordCDataByteOffset'],f['CoordADataByteOffset'],f['IntensityDataByteOffset']],self.data(frameNos)): ret[:,off:off+w2]=d.astype(d.dtype.newbyteorder('<')).view(np.uint8)
+        ret[:,f['FooterDataByteOffset']:]=self.footers(frameNos,self.timestamps(frameNos))
+        return ret
+    def payloadBytes(self,frameNos):
+        'Return payloads of *frameNos* as list of bytes objects, as returned by Aravis.Buffer.get_data.'
+        return [p.tobytes() for p in self.payloads(frameNos)]
+
+
+def simCameras(n,seed=0,**kw):
+    'Return *n* SimCamera instances acting as synchronized sensors (common event numbering, bus ids 0…n-1, independent loss and jitter); *kw* are passed to SimCamera.'
+    return [SimCamera(mdbId=i,seed=seed+i,**kw) for i in range(n)]
+
+
+class ReplayCamera(SimCamera):
+    '''
+    Simulated sensor replaying frames from HDF5 dump *h5name* (group *h5root*, see vrmagicReader.DumpReader), over and over, re-encoded into payloads as the sensor sends them. Raw dumps are replayed exactly, with the scaling constants stored with them; transformed dumps are converted back to raw values using the default scaling of SimDevice.
+
+    Frame numbers, event numbers and timestamps continue to increase with each pass. The frame rate defaults to that of the dump (median timestamp difference); *loss* and *jitter* are applied on top, as with SimCamera.
+    '''
+    def __init__(self,h5name,h5root=None,fps=None,jitter=0.,loss=0.,seed=0,**devKw):
+        self.reader=vrmagicReader.DumpReader(h5name,h5root)
+        r=self.reader
+        SimCamera.__init__(self,jitter=jitter,loss=loss,seed=seed,widthMax=r.width,**devKw)
+        f=self.dev.feats
+        if r.raw:
+            for ds,ax in [(r.C,'C'),(r.A,'A')]:
+                for what in ('Scale','Offset'):
+                    for part in ('Numerator','Denominator'): f['Scan3dCoordinate%s%s_%s'%(ax,what,part)]=int(ds.attrs[what.lower()+part])
+            f['Scan3dInvalidDataValue']=int(r.C.attrs['invalid'])
+        ts=r.timestamps()
+        if fps is None: fps=1./np.median(np.diff(ts[:10000])) if len(ts)>1 else 1000.
+        self.dev.set_integer_feature_value('AcquisitionFrameRate_mHz',int(round(1000*fps)))
+        self.duration=len(r)/fps
+    def _toRaw(self,X,ax):
+        'Convert transformed coordinates *X* of axis *ax* back to raw int16.'
+        f=self.dev.feats
+        scale=f['Scan3dCoordinate%sScale_Numerator'%ax]/f['Scan3dCoordinate%sScale_Denominator'%ax]
+        off=f['Scan3dCoordinate%sOffset_Numerator'%ax]/f['Scan3dCoordinate%sOffset_Denominator'%ax]
+        if X.dtype.kind=='f': invalid,X=np.isnan(X),X.astype('float64')
+        else:
+            dtype,mult,invalidOut=vrmagicTransformer.coordDtypes['int32um']
+            invalid,X=(X==invalidOut),X/mult
+        ret=np.round((np.where(invalid,off,X)-off)/scale).astype('int16')
+        ret[invalid]=f['Scan3dInvalidDataValue']
+        return ret
+    def payloads(self,frameNos):
+        r,f=self.reader,self.dev.feats
+        frameNos=np.asarray(frameNos)
+        passes,ix=np.divmod(frameNos,len(r))
+        # read the covering range once (frames are mostly consecutive), pick rows from it
+        lo,hi=ix.min(),ix.max()+1
+        sl=slice(lo,hi)
+        C,A,I=r.C[sl][ix-lo],r.A[sl][ix-lo],r.I[sl][ix-lo]
+        if not r.raw: C,A=self._toRaw(C,'C'),self._toRaw(A,'A')
+        def field(name,default):
+            return r.grp[name][sl,0][ix-lo] if name in r.grp else default
+        ts=field('timestamp',ix/self.fps())+passes*self.duration
+        if self.jitter>0: ts=np.maximum(ts+self.rng.normal(0,self.jitter,len(ts)),0)
+        evNo=(field('eventNo',self.evNo0+ix).astype('int64')+passes*len(r))%2**16
+        ret=np.zeros((len(frameNos),self.get_payload()),dtype=np.uint8)
+        w2=2*f['AOIWidth']
+        for off,d in zip([f['CoordCDataByteOffset'],f['CoordADataByteOffset'],f['IntensityDataByteOffset']],(C,A,I)): ret[:,off:off+w2]=np.ascontiguousarray(d,dtype=d.dtype.newbyteorder('<')).view(np.uint8)
+        ret[:,f['FooterDataByteOffset']:]=self.footers(frameNos,ts,eventNos=evNo,triggerIds=field('triggerId',None),encoderPositions=field('encoderPosition',None))
+        return ret
@@ -0,0 +1,138 @@
+import numpy as np
+import time
+
+import vrmagicH5Writer, vrmagicMetrics
+
+
+class ColumnStats:
+    '''
+    Running statistics of one quantity for each of *width* columns, updated batch by batch: count of valid values, mean and variance (Welford's algorithm in its batched form: statistics of each batch are merged into the running ones, so that there is no loss of precision over long runs), min, max and count of outliers.
+    '''
+    def __init__(self,width):
+        self.width=width
+        self.reset()
+    def reset(self):
+        'Start over.'
+        W=self.width
+        self.count,self.outliers=np.zeros(W,dtype='int64'),np.zeros(W,dtype='int64')
+        self.mean,self.m2=np.zeros(W),np.zeros(W)
+        self.min,self.max=np.full(W,np.inf),np.full(W,-np.inf)
+    @classmethod
+    def fromBatch(cls,X,valid,outliers=None):
+        'Return statistics of N frames *X* (N,width), where *valid* (boolean, same shape); *outliers* (boolean, same shape) are counted.'
+        ret=cls(X.shape[1])
+        ret.count=valid.sum(axis=0)
+        Xf=np.where(valid,X,0).astype('float64')
+        with np.errstate(invalid='ignore',divide='ignore'): ret.mean=np.where(ret.count>0,Xf.sum(axis=0)/ret.count,0.)
+        ret.m2=(np.where(valid,Xf-ret.mean,0.)**2).sum(axis=0)
+        ret.min=np.where(valid,Xf,np.inf).min(axis=0,initial=np.inf)
+        ret.max=np.where(valid,Xf,-np.inf).max(axis=0,initial=-np.inf)
+        if outliers is not None: ret.outliers=outliers.sum(axis=0)
+        return ret
+    def merge(self,other):
+        'Add statistics *other* (e.g. of a batch, see fromBatch), combining means and sums of squared deviations pairwise (Chan et al.).'
+        tot=self.count+other.count
+        with np.errstate(invalid='ignore',divide='ignore'):
+            f=np.where(tot>0,other.count/tot,0.)
+            delta=other.mean-self.mean
+            self.mean+=delta*f
+            self.m2+=other.m2+delta**2*self.count*f
+        self.count=tot
+        self.min,self.max=np.fmin(self.min,other.min),np.fmax(self.max,other.max)
+        self.outliers+=other.outliers
+    def update(self,X,valid,outliers=None):
+        'Add N frames *X* (N,width), where *valid* (boolean, same shape); *outliers* (boolean, same shape) are counted.'
+        self.merge(self.fromBatch(X,valid,outliers))
+    def var(self):
+        'Sample variance of each column (nan with fewer than 2 values).'
+        with np.errstate(invalid='ignore',divide='ignore'): return np.where(self.count>1,self.m2/(self.count-1),np.nan)
+    def std(self): return np.sqrt(self.var())
+    def outlierMask(self,X,valid,sigma=None,limits=None,minCount=100):
+        '''
+        Return boolean mask of valid values of *X* (N,width) which are outside of *limits* (lo,hi), or (with *sigma*) further than *sigma* standard deviations from the running mean of the column; columns with fewer than *minCount* values so far have no outliers of the latter kind.
+        '''
+        ret=np.zeros(X.shape,dtype=bool)
+        if limits is not None: ret|=(X<limits[0])|(X>limits[1])
+        if sigma is not None:
+            with np.errstate(invalid='ignore'): ret|=(self.count>=minCount)&(np.abs(X-self.mean)>sigma*self.std())
+        return ret&valid
+    def snapshot(self):
+        'Return dict of float32 arrays mean, std, min, max (nan for columns without values) and int arrays count and outliers.'
+        none=self.count==0
+        return dict(count=self.count.copy(),mean=np.where(none,np.nan,self.mean).astype('float32'),std=self.std().astype('float32'),min=np.where(none,np.nan,self.min).astype('float32'),max=np.where(none,np.nan,self.max).astype('float32'),outliers=self.outliers.copy())
+
+
+class ProfileStats:
+    '''
+    Streaming reduction of frames to per-column statistics (see ColumnStats) of z and intensity, for monitoring static scenes and sensor drift without storing frames. Both quantities are taken where z is valid.
+
+    Batches are passed to process(). Every *interval* seconds of sensor time (footer timestamps), statistics of the frames of that interval are written as one snapshot (row) through vrmagicH5Writer.H5Writer to *h5name* under *h5root*: datasets time (start of the interval), frames, count, and z_/intensity_ mean, std, min, max and outliers (one value per column); intervals without frames are skipped. *interval*=None writes snapshots only when snapshot() is called. Running statistics since the start are kept in *total* (and used as reference for outliers), those of the current interval in *window*.
+
+    Outliers are values outside *zLimits* or *intensityLimits* (lo,hi), or, with *sigma*, further than *sigma* standard deviations from the running mean of the column (once the column has *minCount* values). With *invalid*, z values equal to it are invalid (integer coordinates: raw int16, with VRMagicTransformer.invalid, or int32um, with VRMagicTransformer.coordInvalid), otherwise nan's. *writerKw* are passed to H5Writer.
+    '''
+    quantities=('z','intensity')
+    def __init__(self,width,interval=60.,h5name=None,h5root='stats',sigma=None,zLimits=None,intensityLimits=None,minCount=100,invalid=None,**writerKw):
+        self.width,self.interval,self.sigma,self.minCount,self.invalid=width,interval,sigma,minCount,invalid
+        self.limits=dict(z=zLimits,intensity=intensityLimits)
+        self.total={q:ColumnStats(width) for q in self.quantities}
+        self.window={q:ColumnStats(width) for q in self.quantities}
+        # start of the current interval (sensor time) and frames in it
+        self.tWindow=None
+        self.windowFrames=self.frames=self.snapshots=0
+        self.processLatency=vrmagicMetrics.Histogram()
+        self.writer=None
+        if h5name:
+            columns=[('time',1,'float64'),('frames',1,'uint64'),('count',width,'uint32')]+[('%s_%s'%(q,s),width,'uint32' if s=='outliers' else 'float32') for q in self.quantities for s in ('mean','std','min','max','outliers')]
+            self.writer=vrmagicH5Writer.H5Writer(h5name,h5root,columns,chunkRows=1,attrs=dict(time=dict(interval=interval or 0.,sigma=sigma or 0.,minCount=minCount)),**writerKw)
+    def process(self,C,A,I,footer):
+        'Add batch of N frames (as returned by Acquisition batches or VRMagicTransformer.payloads2arrays), writing snapshots of intervals which are complete.'
+        t0=time.perf_counter()
+        if len(footer)==0: return
+        ts=footer['timestamp']
+        if self.tWindow is None: self.tWindow=float(ts[0])
+        i=0
+        while i<len(ts):
+            # frames up to the end of the current interval
+            j=len(ts) if self.interval is None else i+int(np.searchsorted(ts[i:],self.tWindow+self.interval,side='left'))
+            if j>i: self._update(C[i:j],I[i:j])
+            if j==len(ts): break
+            self.snapshot()
+            # next interval containing the next frame (intervals without frames are skipped)
+            self.tWindow+=self.interval*max(1,np.floor((ts[j]-self.tWindow)/self.interval))
+            i=j
+        self.processLatency.observe(time.perf_counter()-t0)
+    def _update(self,C,I):
+        valid=(C!=self.invalid) if self.invalid is not None else ~np.isnan(C)
+        for q,X in zip(self.quantities,(C,I)):
+            out=self.total[q].outlierMask(X,valid,self.sigma,self.limits[q],self.minCount) if self.sigma is not None or self.limits[q] is not None else None
+            batch=ColumnStats.fromBatch(X,valid,out)
+            self.total[q].merge(batch)
+            self.window[q].merge(batch)
+        self.windowFrames+=len(C)
+        self.frames+=len(C)
+    def snapshot(self):
+        'Write statistics of the current interval (if it has any frames) and start a new one; return them as dict (None without frames).'
+        if self.windowFrames==0: return None
+        ret=dict(time=self.tWindow,frames=self.windowFrames)
+        for q in self.quantities:
+            snap=self.window[q].snapshot()
+            ret['count']=snap.pop('count')
+            for k,v in snap.items(): ret['%s_%s'%(q,k)]=v
+        if self.writer: self.writer.append(**{k:np.atleast_1d(v) for k,v in ret.items()})
+        for s in self.window.values(): s.reset()
+        self.windowFrames=0
+        self.snapshots+=1
+        return ret
+    def close(self):
+        'Write the last (incomplete) interval and close the HDF5 writer (if any).'
+        self.snapshot()
+        if self.writer: self.writer.close()
+    def __enter__(self): return self
+    def __exit__(self,*args): self.close()
+    def stats(self):
+        'Return dict with frames processed, snapshots written, fraction of valid z values and total outliers (of z and intensity) since start.'
+        z=self.total['z']
+        return dict(frames=self.frames,snapshots=self.snapshots,validFraction=float(z.count.sum())/max(self.frames*self.width,1),zOutliers=int(z.outliers.sum()),intensityOutliers=int(self.total['intensity'].outliers.sum()))
+    def metrics(self):
+        'Return (scalars,histograms) for vrmagicMetrics.MetricsExporter: stats() and time to process each batch.'
+        return self.stats(),dict(process_seconds=self.processLatency)
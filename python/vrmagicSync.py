@@ -0,0 +1,138 @@
+import numpy as np
+import threading
+
+import vrmagicTransformer, vrmagicAcquisition
+
+
+class EvSyncGatherer:
+    '''
+    Gathers frames from *nSensors* hardware-synchronized sensors by their event number, which is modular (*evNoMod*), not monotonic; frames may arrive somewhat out-of-order and from different threads (each call of push is locked). This is the Python counterpart of EvSyncBuf in ../cxx/synced.cpp.
+
+    Frames are stored in a preallocated gather ring of *rows* events; it must span at least as many events as one sensor may deliver ahead of the others (e.g. its buffer pool, when one acquisition thread drains it in a burst), otherwise events are discarded before the other sensors catch up. Once an event is gathered (frames from all sensors are present), it is copied into *out* (FrameRing with *sensors*, i.e. (nSensors,width) arrays per slot) and all older events are discarded; events discarded before being complete are counted in *incomplete*.
+    '''
+    def __init__(self,nSensors,width,rows=64,evNoMod=2**16,coordDtype='float32',raw=False,outSize=1024,policy='dropNewest'):
+        self.nSensors,self.rows,self.evNoMod=nSensors,rows,evNoMod
+        self.gather=vrmagicTransformer.FrameRing(rows,width,coordDtype=coordDtype,raw=raw,sensors=nSensors)
+        self.filled=np.zeros((rows,nSensors),dtype=bool)
+        self.out=vrmagicTransformer.FrameRing(outSize,width,coordDtype=coordDtype,raw=raw,policy=policy,sensors=nSensors)
+        # lowest event number we will store; if negative, not yet initialized
+        self.ev0=-1
+        # row index for ev0 (will be moving)
+        self.ev0ix=0
+        # consecutive discarded frames; if too many, start using those
+        self.discarded=0
+        # statistics: events gathered, events discarded incomplete, frames discarded (too old), frames overwritten (same event from the same sensor twice)
+        self.gathered=self.incomplete=self.discardedFrames=self.overwritten=0
+        self.lock=threading.Lock()
+    def evRow(self,evNo):
+        'Row for *evNo*, or -1 if it is out of the current window.'
+        d=(evNo-self.ev0)%self.evNoMod
+        return (self.ev0ix+d)%self.rows if d<self.rows else -1
+    def moveToEvNo(self,evNo):
+        'Move the window so that it starts at *evNo*, clearing rows of events left behind.'
+        d=(evNo-self.ev0)%self.evNoMod
+        for i in range(min(d,self.rows)):
+            r=(self.ev0ix+i)%self.rows
+            if self.filled[r].any():
+                self.incomplete+=1
+                self.filled[r]=False
+        self.ev0ix=(self.ev0ix+d)%self.rows
+        self.ev0=evNo
+    def push(self,src,C,A,I,footer):
+        '''
+        Push frame from sensor *src* (index); returns True if its event was gathered (and moved to *out*) by this frame.
+        '''
+        with self.lock:
+            evNo=int(footer['eventNo'])%self.evNoMod
+            if self.ev0<0: self.ev0=evNo # first call ever
+            row=self.evRow(evNo)
+            if row<0:
+                fwdDist=(evNo-self.ev0)%self.evNoMod
+                if fwdDist>self.evNoMod//2 and self.discarded<20:
+                    # recent past or very distant future, discard
+                    self.discarded+=1
+                    self.discardedFrames+=1
+                    return False
+                # distant past or very near future, move ahead
+                self.moveToEvNo((evNo-self.rows+1)%self.evNoMod if fwdDist<self.evNoMod//2 else evNo)
+                row=self.evRow(evNo)
+            self.discarded=0
+            g=self.gather
+            if self.filled[row,src]: self.overwritten+=1
+            g.C[row,src],g.A[row,src],g.I[row,src],g.footer[row,src]=C,A,I,footer
+            self.filled[row,src]=True
+            if not self.filled[row].all(): return False
+            # gathered: hand over, discard everything older
+            i=self.out.reserve()
+            if i is not None:
+                self.out.C[i],self.out.A[i],self.out.I[i],self.out.footer[i]=g.C[row],g.A[row],g.I[row],g.footer[row]
+                self.out.commit()
+            self.filled[row]=False
+            self.gathered+=1
+            self.moveToEvNo((evNo+1)%self.evNoMod)
+            return True
+    def metrics(self):
+        'Return (scalars,histograms) for vrmagicMetrics.MetricsExporter.'
+        return dict(gathered=self.gathered,incomplete=self.incomplete,discardedFrames=self.discardedFrames,overwritten=self.overwritten,dropped=self.out.dropped,queued=len(self.out)),{}
+
+
+class _GatherInput(vrmagicTransformer.FrameRing):
+    'Single-slot ring into which Acquisition of one sensor decodes; committed frames go straight to the gatherer.'
+    def __init__(self,gatherer,src,width,coordDtype,raw):
+        vrmagicTransformer.FrameRing.__init__(self,1,width,coordDtype=coordDtype,raw=raw)
+        self.gatherer,self.src=gatherer,src
+    def commit(self):
+        self.gatherer.push(self.src,self.C[0],self.A[0],self.I[0],self.footer[0])
+
+
+class SyncedAcquisition:
+    '''
+    Acquisition from any number of synchronized sensors (*cams*, the first one being master of the multi-device bus, others slaves), each in its own thread (vrmagicAcquisition.Acquisition) decoding straight into EvSyncGatherer. Gathered events are iterated over in batches like with Acquisition, each batch being (C,A,I,footer) with shapes (N,nSensors,width) and (N,nSensors).
+
+    *trsfs* are transformers for each camera; *fps* sets the frame rate of the master. *acqClass* is the acquisition class used for each sensor (vrmagicAcquisition.SimAcquisition for simulated sensors, see vrmagicSim.simCameras), *acqKw* are passed to it. The gather ring holds *gatherRows* events, by default as many as one sensor can deliver in a burst (*nBuffers*, or SimAcquisition's *block* if larger).
+    '''
+    def __init__(self,cams,trsfs,fps=None,nBuffers=64,gatherRows=None,outSize=1024,raw=False,policy='dropNewest',evNoMod=2**16,acqClass=vrmagicAcquisition.Acquisition,**acqKw):
+        self.cams,self.trsfs=cams,trsfs
+        widths=set(t.width for t in trsfs)
+        if len(widths)!=1: raise ValueError('All sensors must have the same AOI width (got %s).'%widths)
+        width=widths.pop()
+        for i,c in enumerate(cams):
+            dev=c.get_device()
+            dev.set_boolean_feature_value('TrigOutMultiDeviceBusEnable',i==0)
+            dev.set_boolean_feature_value('TrigInMultiDeviceBusEnable',i>0)
+        if fps is not None: cams[0].get_device().set_integer_feature_value('AcquisitionFrameRate_mHz',int(round(1000*fps)))
+        if gatherRows is None: gatherRows=max(nBuffers,acqKw.get('block',0))
+        self.gatherer=EvSyncGatherer(len(cams),width,rows=gatherRows,evNoMod=evNoMod,coordDtype=trsfs[0].coordDtype,raw=raw,outSize=outSize,policy=policy)
+        self.acqs=[acqClass(c,t,nBuffers=nBuffers,ring=_GatherInput(self.gatherer,i,width,t.coordDtype,raw),**acqKw) for i,(c,t) in enumerate(zip(cams,trsfs))]
+        self.running=False
+    def start(self):
+        'Start slaves first, then the master, so that no event is missed by slaves.'
+        self.running=True
+        for a in self.acqs[::-1]: a.start()
+    def stop(self):
+        self.running=False
+        for a in self.acqs: a.stop()
+    def __enter__(self):
+        self.start()
+        return self
+    def __exit__(self,*args): self.stop()
+    def metrics(self):
+        'Return (scalars,histograms) for vrmagicMetrics.MetricsExporter: gatherer statistics, and metrics of each sensor (prefixed with sensor index).'
+        scalars,hists=self.gatherer.metrics()
+        for i,a in enumerate(self.acqs):
+            s,h=a.metrics()
+            scalars.update({'s%d_%s'%(i,k):v for k,v in s.items()})
+            hists.update({'s%d_%s'%(i,k):v for k,v in h.items()})
+        return scalars,hists
+    def batches(self,n=None,timeout=.1):
+        'Yield batches of at most *n* gathered events; see vrmagicAcquisition.iterRing. Iteration ends when a sensor\'s producer thread fails, raising its error (see Acquisition.batches).'
+        yield from vrmagicAcquisition.iterRing(self.gatherer.out,self._isRunning,n,timeout)
+        self._checkError()
+    def __iter__(self): return self.batches()
+    async def abatches(self,n=None,timeout=.1):
+        async for batch in vrmagicAcquisition.aiterRing(self.gatherer.out,self._isRunning,n,timeout): yield batch
+        self._checkError()
+    def _isRunning(self): return self.running and not any(a.error for a in self.acqs)
+    def _checkError(self):
+        for a in self.acqs: a._checkError()
+    def __aiter__(self): return self.abatches()
@@ -1,64 +1,206 @@
 import numpy as np
-import ctypes, struct, warnings
+import ctypes, struct, warnings, threading, json, os
 
+# output types of transformed coordinates: numpy dtype, multiplier of physical units, value for invalid data
+coordDtypes={
+    'float32':(np.dtype('float32'),1.,np.nan),
+    'float16':(np.dtype('float16'),1.,np.nan),
+    # scaled to micrometres (sensor reports millimetres)
+    'int32um':(np.dtype('int32'),1000.,np.iinfo('int32').min),
+}
+
+def makeLUT(scale,off,invalid,coordDtype='float32'):
+    '''
+    Return lookup table of physical coordinates (*scale*×raw+*off*, in *coordDtype*, see *coordDtypes*) for all 2^16 raw int16 values, indexed by raw value reinterpreted as uint16; the *invalid* raw value maps to nan (or the integer invalid value).
+    '''
+    dtype,mult,invalidOut=coordDtypes[coordDtype]
+    lut=(scale*np.arange(2**16,dtype='uint16').view('int16')+off)*mult
+    if dtype.kind=='i': lut=np.round(lut)
+    lut=lut.astype(dtype)
+    lut[np.uint16(np.int16(invalid))]=invalidOut
+    return lut
+
+# decoded footer fields, as returned by VRMagicTransformer.payloads2arrays
+footerDtype=np.dtype([('timestamp','f8'),('frameNo','u2'),('eventNo','u2'),('multiDeviceBusId','u2'),('triggerId','u2'),('encoderPosition','u4')])
+
+# device features read by VRMagicTransformer which do not change with configuration (see *cache*)
+scalingFeatures=['Scan3dCoordinateAScale_Numerator','Scan3dCoordinateAScale_Denominator','Scan3dCoordinateAOffset_Numerator','Scan3dCoordinateAOffset_Denominator','Scan3dCoordinateCScale_Numerator','Scan3dCoordinateCScale_Denominator','Scan3dCoordinateCOffset_Numerator','Scan3dCoordinateCOffset_Denominator']
+constantFeatures=['FooterTimestampTickFrequency','IntraFooterStartOfExposureTimestampByteOffset','Scan3dInvalidDataValue','IntraFooterTriggerPipelineNumberByteOffset','IntraFooterMDBDeviceIDByteOffset','IntraFooterEventNumberByteOffset','IntraFooterFrameCounterByteOffset','IntraFooterEncoderPositionByteOffset','HeightMax','WidthMax']+scalingFeatures
+
+def loadCache(cacheName):
+    'Return contents of cache file *cacheName* (see VRMagicTransformer), or empty dict if it does not exist.'
+    if not os.path.exists(cacheName): return {}
+    with open(cacheName) as f: return json.load(f)
 
 class VRMagicTransformer:
-    def __init__(self,cam,yAOI=None,xAOI=None,fps=None):
+    def __init__(self,cam,yAOI=None,xAOI=None,fps=None,coordDtype='float32',cache=None):
         '''
         The constructor initializes the sensor (transfer coordinates rather than images, include intensity, lateral coordinate and footer data) and reads coordinate transformation constants. 
+
+        *coordDtype* selects type of transformed coordinates, one of the keys in *coordDtypes*: 'float32' (default), 'float16' or 'int32um' (integer micrometres; invalid data are marked with *coordInvalid* rather than nan).
+
+        *cache* names a JSON file where constants (*constantFeatures*) and payload layouts for each AOI are kept per device (Aravis device id, which includes the serial number) and firmware version; when found there, they are not read from the device again, saving most round-trips on every start and reconnect. Any number of devices can share one cache file. See also fromCache.
         '''
-        dev=cam.get_device()
+        self._setCoordDtype(coordDtype)
+        self.cam,self.dev=cam,cam.get_device()
+        dev=self.dev
         # device setup
         dev.set_string_feature_value('TransferFormat','PROFILE_COORD16')
         dev.set_integer_feature_value('IntensityDataEnable',1)
         dev.set_integer_feature_value('CoordADataEnable',1)
         dev.set_integer_feature_value('FooterDataEnable',1)
-        # get constants
-        self.tickHz=dev.get_integer_feature_value('FooterTimestampTickFrequency')
-        self.tickOffset=dev.get_integer_feature_value('IntraFooterStartOfExposureTimestampByteOffset')
-        self.invalid=dev.get_integer_feature_value('Scan3dInvalidDataValue')
-        self.triggerNoOffset=dev.get_integer_feature_value('IntraFooterTriggerPipelineNumberByteOffset')
-        self.multiDeviceBusIdOffset=dev.get_integer_feature_value('IntraFooterMDBDeviceIDByteOffset')
-        self.eventNoOffset=dev.get_integer_feature_value('IntraFooterEventNumberByteOffset')
-        self.frameCntOff=dev.get_integer_feature_value("IntraFooterFrameCounterByteOffset")
-        feats=[dev.get_integer_feature_value(f) for f in ['Scan3dCoordinateAScale_Numerator','Scan3dCoordinateAScale_Denominator','Scan3dCoordinateAOffset_Numerator','Scan3dCoordinateAOffset_Denominator','Scan3dCoordinateCScale_Numerator','Scan3dCoordinateCScale_Denominator','Scan3dCoordinateCOffset_Numerator','Scan3dCoordinateCOffset_Denominator']]
+        # get constants; cache entry is validated by device id (known from discovery) and firmware version (single read)
+        self.cacheName=cache
+        self.serial=self.firmware=self.cacheKey=entry=None
+        if cache:
+            self.serial,self.firmware=cam.get_device_id(),dev.get_string_feature_value('DeviceFirmwareVersion')
+            self.cacheKey='%s/%s'%(self.serial,self.firmware)
+            entry=loadCache(cache).get(self.cacheKey)
+        # entries written by older versions may lack some constants
+        if entry and set(constantFeatures)<=set(entry['constants']): self.consts,self.layouts=entry['constants'],entry['layouts']
+        else:
+            self.consts,self.layouts=self.readConstants(),{}
+            self.saveCache()
+        self._setConstants()
+        self.setAOI(yAOI=yAOI,xAOI=xAOI)
+        if fps is not None:
+            mFps=int(round(1000*fps))
+            dev.set_integer_feature_value('AcquisitionFrameRate_mHz',mFps)
+            print('Setting frame rate [mHz]',mFps)
+            print('Max frame rate with current AOI [mHz]:',dev.get_integer_feature_value('AcquisitionFrameRateMax_mHz'))
+    def _setCoordDtype(self,coordDtype):
+        if coordDtype not in coordDtypes: raise ValueError("coordDtype must be one of: "+', '.join(coordDtypes.keys()))
+        self.coordDtypeName=coordDtype
+        self.coordDtype,self.coordMult,self.coordInvalid=coordDtypes[coordDtype]
+    def readConstants(self):
+        'Read *constantFeatures* from the device, return them as dict.'
+        ret={f:self.dev.get_integer_feature_value(f) for f in constantFeatures}
+        feats=[ret[f] for f in scalingFeatures]
         # do we need the bug workaround? see https://github.com/AravisProject/aravis/issues/147
         if max(feats)>=2**31: 
             # HACK: convert back to uint64 (8 bytes), take only 4, convert to signed int32
             warnings.warn('Signed int32 bug in Aravis detected, activating workaround. See https://github.com/AravisProject/aravis/issues/147 for details and update Aravis.')
-            asn,asd,aon,aod,csn,csd,con,cod=[struct.unpack('i',struct.pack('Q',f)[:4])[0] for n in feats]
-        else: asn,asd,aon,aod,csn,csd,con,cod=feats
+            ret.update({n:struct.unpack('i',struct.pack('Q',f)[:4])[0] for n,f in zip(scalingFeatures,feats)})
+        return ret
+    def _setConstants(self):
+        'Set attributes from *consts* (see readConstants) and build lookup tables.'
+        c=self.consts
+        self.tickHz=c['FooterTimestampTickFrequency']
+        self.tickOffset=c['IntraFooterStartOfExposureTimestampByteOffset']
+        self.invalid=c['Scan3dInvalidDataValue']
+        self.triggerNoOffset=c['IntraFooterTriggerPipelineNumberByteOffset']
+        self.multiDeviceBusIdOffset=c['IntraFooterMDBDeviceIDByteOffset']
+        self.eventNoOffset=c['IntraFooterEventNumberByteOffset']
+        self.frameCntOff=c['IntraFooterFrameCounterByteOffset']
+        self.encoderPositionOffset=c['IntraFooterEncoderPositionByteOffset']
+        # footer fields as they are laid out in the payload (little-endian, as the sensor sends them)
+        self.rawFooterFields=[('tick','<u8',self.tickOffset),('frameNo','<u2',self.frameCntOff),('eventNo','<u2',self.eventNoOffset),('multiDeviceBusId','<u2',self.multiDeviceBusIdOffset),('triggerId','<u2',self.triggerNoOffset),('encoderPosition','<u4',self.encoderPositionOffset)]
+        asn,asd,aon,aod,csn,csd,con,cod=[c[f] for f in scalingFeatures]
         self.cs,self.co,self.as_,self.ao=csn/csd,con/cod,asn/asd,aon/aod
         self.asn,self.asd,self.aon,self.aod,self.csn,self.csd,self.con,self.cod=asn,asd,aon,aod,csn,csd,con,cod
-        if yAOI is not None:
-            if len(yAOI)!=2: raise ValueError("AOI must be a 2-tuple (yOff,yDim)")
-            yOff,yDim=yAOI
-            print('Setting y-AOI with offset %d, height %d (sensor does not capture beyond yAOI)'%(yOff,yDim))
-            dev.set_integer_feature_value('AOIOffsetY',yOff)
-            dev.set_integer_feature_value('AOIHeight',yDim)
-        else:
+        self.buildLUT()
+    def saveCache(self):
+        'Store constants and known payload layouts of this device in the cache file (if any); the file is replaced atomically.'
+        if not self.cacheName: return
+        cache=loadCache(self.cacheName)
+        # re-inserted, so that the entry saved last comes last (see fromCache)
+        cache.pop(self.cacheKey,None)
+        cache[self.cacheKey]=dict(constants=self.consts,layouts=self.layouts)
+        with open(self.cacheName+'.tmp','w') as f: json.dump(cache,f,indent=1)
+        os.replace(self.cacheName+'.tmp',self.cacheName)
+    @classmethod
+    def fromCache(cls,cacheName,serial=None,aoi=None,coordDtype='float32'):
+        '''
+        Create transformer from cache file *cacheName* alone, without device, e.g. to decode recorded payloads offline. *serial* selects the device by its Aravis device id (it may be omitted if the cache holds just one; of several firmware versions, the one saved last is used). *aoi* selects payload layout as (yOff,yDim,xOff,xDim), ValueError is raised if it is not in the cache; by default, the layout saved last (added or changed most recently) is used. Payload layout can not be re-read without device, so payloads of unexpected size raise RuntimeError.
+        '''
+        cache=loadCache(cacheName)
+        keys=[k for k in cache if serial is None or k.split('/')[0]==str(serial)]
+        if len(set(k.split('/')[0] for k in keys))!=1: raise ValueError('Cache %s must hold exactly one device%s (has: %s).'%(cacheName,'' if serial is None else ' with device id %s'%serial,', '.join(cache) or 'none'))
+        self=cls.__new__(cls)
+        self._setCoordDtype(coordDtype)
+        self.cam=self.dev=self.cacheName=None
+        self.cacheKey=keys[-1]
+        self.serial,self.firmware=self.cacheKey.split('/',1)
+        self.consts,self.layouts=cache[self.cacheKey]['constants'],cache[self.cacheKey]['layouts']
+        self._setConstants()
+        if not self.layouts: raise ValueError('No payload layout stored for %s in %s.'%(self.cacheKey,cacheName))
+        self.aoiKey=list(self.layouts)[-1] if aoi is None else ','.join('%d'%a for a in aoi)
+        if self.aoiKey not in self.layouts: raise ValueError('No payload layout stored for AOI %s of %s in %s (cached AOIs: %s).'%(self.aoiKey,self.cacheKey,cacheName,'; '.join(self.layouts)))
+        self.yAOI,self.xAOI=[tuple(int(a) for a in ax) for ax in (self.aoiKey.split(',')[:2],self.aoiKey.split(',')[2:])]
+        self._setLayout(self.layouts[self.aoiKey])
+        return self
+    def setAOI(self,yAOI=None,xAOI=None):
+        '''
+        Program y-AOI (sensor rows which are captured) and x-AOI (columns which are transferred) on the device, as 2-tuples (offset,dimension); None reverts to the full sensor. Payload layout is re-read afterwards, as it changes with AOI (unless it is cached for this AOI).
+        '''
+        aois=[]
+        for aoi,ax,offName,dimName,maxName in [(yAOI,'y','AOIOffsetY','AOIHeight','HeightMax'),(xAOI,'x','AOIOffsetX','AOIWidth','WidthMax')]:
+            if aoi is not None:
+                if len(aoi)!=2: raise ValueError("%s-AOI must be a 2-tuple (%sOff,%sDim)"%(ax,ax,ax))
+                print('Setting %s-AOI with offset %d, %s %d (sensor does not transfer data beyond %s-AOI)'%(ax,aoi[0],'height' if ax=='y' else 'width',aoi[1],ax))
             # revert to defaults in case the sensor was set differently just before
-            dev.set_integer_feature_value('AOIOffsetY',0)
-            dev.set_integer_feature_value('AOIHeight',dev.get_integer_feature_value('HeightMax'))
-        if xAOI is not None:
-            if len(xAOI)!=2: raise ValueError("xAOI must be a 2-tuple (xOff,xDim)")
-            print('Setting x-AOI with offset %d, width %d (data out of xAOI will be discarded)'%(xAOI[0],xAOI[1]))
-        self.xAOI=xAOI
-        if fps is not None:
-            mFps=int(round(1000*fps))
-            dev.set_integer_feature_value('AcquisitionFrameRate_mHz',mFps)
-            print('Setting frame rate [mHz]',mFps)
-            print('Max frame rate with current AOI [mHz]:',dev.get_integer_feature_value('AcquisitionFrameRateMax_mHz'))
+            else: aoi=(0,self.consts[maxName])
+            # zero the offset first, so that the device accepts any dimension
+            self.dev.set_integer_feature_value(offName,0)
+            self.dev.set_integer_feature_value(dimName,aoi[1])
+            self.dev.set_integer_feature_value(offName,aoi[0])
+            aois+=aoi
+        self.yAOI,self.xAOI=yAOI,xAOI
+        self.aoiKey=','.join('%d'%a for a in aois)
+        # cached layout is validated by payload size (single read)
+        if self.aoiKey in self.layouts and self.layouts[self.aoiKey]['payloadSize']==self.cam.get_payload(): self._setLayout(self.layouts[self.aoiKey])
+        else: self.queryPayloadLayout()
+    def _setLayout(self,layout):
+        'Set payload layout from dict with payloadSize, cOff, aOff, iOff, footerOff and width.'
+        self.payloadSize,self.cOff,self.aOff,self.iOff,self.footerOff,self.width=[layout[k] for k in ('payloadSize','cOff','aOff','iOff','footerOff','width')]
+        self.acceptedSize=self.payloadSize
+        # built once per layout rather than for every decoded frame
+        self.rawFooterDtypeCached=self.rawFooterDtype(self.payloadSize-self.footerOff)
+    def queryPayloadLayout(self,readAOI=False):
+        '''
+        Read payload layout (byte offsets of data blocks and of the footer, AOI width) from the device, and store it in the cache. Must be called whenever AOI changes (setAOI does that); it is also called automatically when payload of unexpected size arrives, in which case AOI is read from the device as well (*readAOI*), as it was changed behind our back.
+        '''
+        dev=self.dev
+        if dev is None: raise RuntimeError('Payload layout can not be re-read without device (transformer created from cache).')
+        if readAOI: self.aoiKey=','.join('%d'%dev.get_integer_feature_value(f) for f in ['AOIOffsetY','AOIHeight','AOIOffsetX','AOIWidth'])
+        imgHt=dev.get_integer_feature_value('ImageHeight')
+        if imgHt!=1: raise RuntimeError('Camera reports image with non-unit height %d?'%imgHt)
+        # width is the number of columns in decoded data
+        layout=dict(zip(('payloadSize','cOff','aOff','iOff','footerOff','width'),[self.cam.get_payload()]+[dev.get_integer_feature_value(f) for f in ['CoordCDataByteOffset','CoordADataByteOffset','IntensityDataByteOffset','FooterDataByteOffset','AOIWidth']]))
+        self._setLayout(layout)
+        if self.layouts.get(self.aoiKey)!=layout:
+            self.layouts.pop(self.aoiKey,None)
+            self.layouts[self.aoiKey]=layout
+            self.saveCache()
+    def checkLayout(self,size):
+        '''
+        Re-read payload layout if payload of *size* bytes does not match it (AOI was changed on the device directly). Payloads larger than the layout (buffers allocated for a larger AOI) are accepted, smaller ones raise ValueError. The layout, including width, may change here: decoding into arrays of the old width raises ValueError (see raw2arrays).
+        '''
+        if size==self.acceptedSize: return
+        self.queryPayloadLayout(readAOI=True)
+        if size<self.payloadSize: raise ValueError('Payload has %d bytes, but the device reports %d bytes (buffers allocated before AOI change?).'%(size,self.payloadSize))
+        self.acceptedSize=size
+    def buildLUT(self):
+        '''
+        Precompute lookup tables (*lutA*, *lutC*) of physical coordinates for all 2^16 raw values, with *coordInvalid* at the invalid value. Tables are indexed by raw int16 data reinterpreted as uint16, so that transformation is a single gather.
+        '''
+        self.lutA=makeLUT(self.as_,self.ao,self.invalid,self.coordDtypeName)
+        self.lutC=makeLUT(self.cs,self.co,self.invalid,self.coordDtypeName)
+    def rawAttrs(self):
+        '''
+        Return dictionary of constants needed to transform raw coordinates, per raw dataset name; stored as attributes of raw datasets in HDF5 dumps (see vrmagicH5Writer.frameColumns and vrmagicReader.DumpReader). Timestamps are stored in seconds already; *convertedFromTickHz* only records the footer tick frequency they were converted from.
+        '''
+        return dict(
+            c16=dict(scaleNumerator=self.csn,scaleDenominator=self.csd,offsetNumerator=self.con,offsetDenominator=self.cod,scale=self.cs,offset=self.co,invalid=self.invalid),
+            a16=dict(scaleNumerator=self.asn,scaleDenominator=self.asd,offsetNumerator=self.aon,offsetDenominator=self.aod,scale=self.as_,offset=self.ao,invalid=self.invalid),
+            timestamp=dict(convertedFromTickHz=self.tickHz),
+        )
     def trsfA(self,a16):
-        'Transform raw uint32 a-coordinate to physical coordinates; invalid values are automatically replaced by nan. Operates on numpy.array.'
-        ret=self.as_*a16+self.ao
-        ret[a16==self.invalid]=np.nan
-        return ret
+        'Transform raw int16 a-coordinate to physical coordinates; invalid values are automatically replaced by nan (or *coordInvalid*). Operates on numpy.array.'
+        return self.lutA[np.asarray(a16).astype('int16',copy=False).view('uint16')]
     def trsfC(self,c16):
-        'Transform raw uint32 c-coordinate to physical coordinates; invalid values are automatically replaced by nan. Operates on numpy.array.'
-        ret=self.cs*c16+self.co
-        ret[c16==self.invalid]=np.nan
-        return ret
+        'Transform raw int16 c-coordinate to physical coordinates; invalid values are automatically replaced by nan (or *coordInvalid*). Operates on numpy.array.'
+        return self.lutC[np.asarray(c16).astype('int16',copy=False).view('uint16')]
     #def x2a16(self,x): return (x-self.ao)/self.as_
     #def z2c16(self,z): return (z-self.co)/self.cs
     def timestampFromFooter(self,footer):
@@ -70,17 +212,195 @@ class VRMagicTransformer:
         return struct.unpack('H',footer[self.multiDeviceBusIdOffset:self.multiDeviceBusIdOffset+2])[0]
     def eventNoFromFooter(self,footer):
         return struct.unpack('H',footer[self.eventNoOffset:self.eventNoOffset+2])[0]
+    def encoderPositionFromFooter(self,footer):
+        return struct.unpack('I',footer[self.encoderPositionOffset:self.encoderPositionOffset+4])[0]
     def frameNoFromFooter(self,footer):
-        return struct.unpack('Q',footer[self.frameCntOff:self.frameCntOff+8])[0]
+        return struct.unpack('H',footer[self.frameCntOff:self.frameCntOff+2])[0]
     def payload2dict(self,payload,retRaw=False):
         '''
         Convert buffer data (as bytes object) to dictionary containing structured data.
         '''
-        arr=np.ctypeslib.as_array(ctypes.cast(payload,ctypes.POINTER(ctypes.c_int16)),(len(payload)//2,)).copy()
-        c16,a16,i16,footer=arr[:2048],arr[2048:4096],arr[4096:6144],arr[6144:].tobytes()
-        sl=slice(self.xAOI[0],self.xAOI[0]+self.xAOI[1]) if self.xAOI else slice(None)
-        ret=dict(A=self.trsfA(a16)[sl],C=self.trsfC(c16)[sl],intensity=i16[sl],timestamp=self.timestampFromFooter(footer),multiDeviceBusId=self.multiDeviceBusIdFromFooter(footer),eventNo=self.eventNoFromFooter(footer),frameNo=self.frameNoFromFooter(footer))
+        self.checkLayout(len(payload))
+        raw=np.frombuffer(payload,dtype=np.uint8)
+        w2=2*self.width
+        c16,a16,i16=[raw[off:off+w2].view(dt).copy() for off,dt in [(self.cOff,'<i2'),(self.aOff,'<i2'),(self.iOff,'<u2')]]
+        footer=payload[self.footerOff:self.payloadSize]
+        ret=dict(A=self.trsfA(a16),C=self.trsfC(c16),intensity=i16,timestamp=self.timestampFromFooter(footer),multiDeviceBusId=self.multiDeviceBusIdFromFooter(footer),eventNo=self.eventNoFromFooter(footer),frameNo=self.frameNoFromFooter(footer),encoderPosition=self.encoderPositionFromFooter(footer))
         if retRaw: ret['c16'],ret['a16'],ret['i16']=c16,a16,i16
         return ret
+    def rawFooterDtype(self,footerLen):
+        'Structured dtype overlaying raw footer bytes (footerLen bytes long), for vectorized extraction of footer fields.'
+        names,formats,offsets=zip(*self.rawFooterFields)
+        return np.dtype(dict(names=names,formats=formats,offsets=offsets,itemsize=footerLen))
+    def payloads2arrays(self,payloads,out=None,footer=None):
+        '''
+        Convert a sequence of N equally-sized payloads (bytes objects; ValueError is raised if sizes differ) in one vectorized pass. Returns (C,A,I,footer), where C, A are (N,width) arrays of *coordDtype*, I is (N,width) uint16 and footer is a structured array of length N with dtype *footerDtype*.
+
+        *out* may be a tuple of (C,A,I) arrays with at least N rows which are written in-place (their first N rows are returned); likewise *footer* may be preallocated structured array of *footerDtype*. This avoids any per-frame allocation when filling larger chunks.
+        '''
+        N=len(payloads)
+        if N==0: return self.raw2arrays(np.zeros((0,self.payloadSize),dtype=np.uint8),out=out,footer=footer)
+        sizes=set(len(p) for p in payloads)
+        if len(sizes)!=1: raise ValueError('Payloads must all have the same size (got sizes %s).'%sorted(sizes))
+        return self.raw2arrays(np.frombuffer(b''.join(payloads),dtype=np.uint8).reshape(N,-1),out=out,footer=footer)
+    def raw2arrays(self,raw,out=None,footer=None,transform=True):
+        '''
+        Decode (N,payloadSize) uint8 array of raw payloads (longer rows are accepted, see checkLayout; other shapes raise ValueError); see payloads2arrays for the meaning of arguments and return value. *raw* is only read from, so it can be a view of foreign memory (see bufferView).
+
+        With *transform*=False, C and A are returned as raw int16 values (c16 and a16) rather than physical coordinates.
+        '''
+        if raw.ndim!=2: raise ValueError('Raw payloads must be a (N,payloadSize) array (got shape %s).'%(raw.shape,))
+        N=raw.shape[0]
+        self.checkLayout(raw.shape[1])
+        # payloads larger than the layout (accepted by checkLayout) are decoded from their first payloadSize bytes
+        raw=raw[:,:self.payloadSize]
+        if raw.shape[1]!=self.payloadSize: raise ValueError('Payloads have %d bytes, but the layout of AOI %s needs %d bytes.'%(raw.shape[1],self.aoiKey,self.payloadSize))
+        # preallocated arrays (e.g. ring slots) keep the width they were created with, while the layout follows AOI changes on the device
+        if out is not None and out[0].shape[1]!=self.width: raise ValueError('AOI width changed to %d columns, but output arrays have %d (stop acquisition and create it anew, so that the ring has the new width).'%(self.width,out[0].shape[1]))
+        w2=2*self.width
+        c16,a16,i16=[raw[:,off:off+w2].view(dt) for off,dt in [(self.cOff,'<i2'),(self.aOff,'<i2'),(self.iOff,'<u2')]]
+        foot=raw[:,self.footerOff:self.payloadSize]
+        cDtype=self.coordDtype if transform else 'int16'
+        if out is None: out=(np.empty(c16.shape,dtype=cDtype),np.empty(a16.shape,dtype=cDtype),np.empty(i16.shape,dtype='uint16'))
+        C,A,I=[o[:N] for o in out]
+        if footer is None: footer=np.empty(N,dtype=footerDtype)
+        F=footer[:N]
+        if transform:
+            np.take(self.lutC,c16.view('<u2'),out=C)
+            np.take(self.lutA,a16.view('<u2'),out=A)
+        else: C[:],A[:]=c16,a16
+        I[:]=i16
+        ff=foot.view(self.rawFooterDtypeCached)[:,0]
+        np.divide(ff['tick'],self.tickHz,out=F['timestamp'],casting='unsafe')
+        for f in footerDtype.names[1:]: F[f]=ff[f]
+        return C,A,I,F
+    def buffer2ring(self,buf,ring):
+        '''
+        Decode Aravis buffer *buf* straight from its memory (no intermediate bytes object) into the next free slot of *ring* (FrameRing). Returns the slot index, or None if the ring is full and the frame was dropped. The buffer can be pushed back to the stream as soon as this returns.
+        '''
+        return self.raw2ring(bufferView(buf),ring)
+    def raw2ring(self,raw,ring):
+        'Decode single payload *raw* (uint8 array) into the next free slot of *ring*; see buffer2ring.'
+        i=ring.reserve()
+        if i is None: return None
+        self.raw2arrays(raw[None,:],out=(ring.C[i:i+1],ring.A[i:i+1],ring.I[i:i+1]),footer=ring.footer[i:i+1],transform=not ring.raw)
+        ring.commit()
+        return i
+
+
+_arvGetData=None
+def bufferView(buf):
+    '''
+    Return uint8 numpy array viewing memory of Aravis buffer *buf* without copying (unlike buf.get_data(), which returns a new bytes object). The view is only valid until the buffer is pushed back to the stream.
+
+    PyGObject does not expose the raw pointer, so arv_buffer_get_data is called through ctypes on the underlying GObject.
+    '''
+    global _arvGetData
+    if _arvGetData is None:
+        import ctypes.util
+        lib=next((l for l in [ctypes.util.find_library(n) for n in ('aravis-0.6','aravis-0.8')] if l),None)
+        if lib is None: raise RuntimeError('libaravis not found (needed for zero-copy buffer access).')
+        _arvGetData=ctypes.CDLL(lib).arv_buffer_get_data
+        _arvGetData.restype=ctypes.c_void_p
+        _arvGetData.argtypes=[ctypes.c_void_p,ctypes.POINTER(ctypes.c_size_t)]
+        ctypes.pythonapi.PyCapsule_GetPointer.restype=ctypes.c_void_p
+        ctypes.pythonapi.PyCapsule_GetPointer.argtypes=[ctypes.py_object,ctypes.c_char_p]
+    size=ctypes.c_size_t()
+    ptr=_arvGetData(ctypes.pythonapi.PyCapsule_GetPointer(buf.__gpointer__,None),ctypes.byref(size))
+    return np.ctypeslib.as_array((ctypes.c_uint8*size.value).from_address(ptr))
+
+
+class RingBase:
+    '''
+    Bookkeeping for preallocated rings of frames (FrameRing, PayloadRing) written by one producer and read by one consumer; memory use is fixed at construction. Frames are reserved (reserve) and committed (commit) by the producer, peeked at (peek) and released (release) by the consumer.
+
+    *policy* says what to do when a new frame arrives while the ring is full; in all cases, frames which are not stored are counted in *dropped*:
+
+    * 'dropNewest': discard the new frame;
+    * 'dropOldest': discard the oldest frame, unless the consumer is just reading it (peeked but not yet released), in which case the new frame is discarded;
+    * 'block': wait (at most *blockTimeout* seconds) for the consumer to release frames, then discard the new frame.
+    '''
+    policies=('dropNewest','dropOldest','block')
+    def __init__(self,size,policy='dropNewest',blockTimeout=1.):
+        if policy not in self.policies: raise ValueError('policy must be one of: '+', '.join(self.policies))
+        self.size,self.policy,self.blockTimeout=size,policy,blockTimeout
+        # absolute frame counters; slot index is counter modulo size
+        self.written=self.peeked=self.released=0
+        self.dropped=0
+        self.cond=threading.Condition()
+    def __len__(self): return self.written-self.released
+    def full(self): return self.written-self.released>=self.size
+    def reserve(self):
+        'Return slot index for the next frame, or None if the frame is to be dropped (see *policy*).'
+        with self.cond:
+            if self.full():
+                if self.policy=='block': self.cond.wait_for(lambda: not self.full(),timeout=self.blockTimeout)
+                elif self.policy=='dropOldest' and self.peeked==self.released:
+                    self.released+=1
+                    self.peeked+=1
+                    self.dropped+=1
+            if self.full():
+                self.dropped+=1
+                return None
+            return self.written%self.size
+    def commit(self):
+        'Make the frame written into the slot from reserve() visible to the consumer.'
+        with self.cond:
+            self.written+=1
+            self.cond.notify_all()
+    def peekRange(self,n=None,timeout=None):
+        'Return slot range (i0,i1) for peek; see peek in derived classes.'
+        with self.cond:
+            if timeout is not None: self.cond.wait_for(lambda: len(self)>=(n or 1),timeout=timeout)
+            i0=self.released%self.size
+            i1=min(i0+len(self),self.size)
+            if n is not None: i1=min(i1,i0+n)
+            self.peeked=max(self.peeked,self.released+i1-i0)
+        return i0,i1
+    def release(self,n):
+        'Release *n* oldest frames (previously returned by peek).'
+        with self.cond:
+            self.released+=n
+            self.peeked=max(self.peeked,self.released)
+            self.cond.notify_all()
+
+
+class FrameRing(RingBase):
+    '''
+    Preallocated ring of decoded frames (see VRMagicTransformer.buffer2ring and RingBase); *coordDtype* must match that of the transformer; with *raw*, frames are stored untransformed (raw int16 coordinates). With *sensors*, each slot holds frames from that many sensors, and arrays have an extra dimension after the slot index.
+    '''
+    def __init__(self,size,width,coordDtype='float32',raw=False,policy='dropNewest',blockTimeout=1.,sensors=None):
+        RingBase.__init__(self,size,policy=policy,blockTimeout=blockTimeout)
+        self.width,self.raw,self.sensors=width,raw,sensors
+        if raw: coordDtype='int16'
+        # with *sensors*, each slot holds one frame from every sensor (gathered by vrmagicSync.EvSyncGatherer)
+        shape=(size,sensors) if sensors else (size,)
+        self.C,self.A=np.zeros(shape+(width,),dtype=coordDtype),np.zeros(shape+(width,),dtype=coordDtype)
+        self.I=np.zeros(shape+(width,),dtype='uint16')
+        self.footer=np.zeros(shape,dtype=footerDtype)
+    def peek(self,n=None,timeout=None):
+        '''
+        Return (C,A,I,footer) views of frames available for reading, in the order they were written; at most *n* frames (all available if None), but never across the end of the ring so that views are contiguous. If *timeout* is given, wait that long for at least *n* (or 1 with n=None) frames to become available. Frames must be released (release) once processed so that the slots can be reused.
+        '''
+        i0,i1=self.peekRange(n,timeout)
+        return self.C[i0:i1],self.A[i0:i1],self.I[i0:i1],self.footer[i0:i1]
 
 
+class PayloadRing(RingBase):
+    '''
+    Preallocated ring of raw payloads (undecoded), *payloadSize* bytes each; used when there is no transformer (e.g. with cameras other than VRMagic). See RingBase.
+    '''
+    def __init__(self,size,payloadSize,policy='dropNewest',blockTimeout=1.):
+        RingBase.__init__(self,size,policy=policy,blockTimeout=blockTimeout)
+        self.payload=np.zeros((size,payloadSize),dtype=np.uint8)
+    def push(self,data):
+        'Copy payload (uint8 array, e.g. from bufferView) into the next slot; return the slot index or None if dropped.'
+        i=self.reserve()
+        if i is None: return None
+        self.payload[i,:len(data)]=data
+        self.commit()
+        return i
+    def peek(self,n=None,timeout=None):
+        'Return 1-tuple with (N,payloadSize) view of payloads available for reading; see FrameRing.peek.'
+        i0,i1=self.peekRange(n,timeout)
+        return (self.payload[i0:i1],)
@@ -0,0 +1,151 @@
+import numpy as np
+import warnings
+
+import vrmagicH5Writer
+
+
+# per-frame statistics of a batch, for Threshold; each takes (C,A,I) of N frames (and *invalid*, see Threshold) and returns N values
+def validZ(C,invalid=None):
+    'Boolean array of valid z (C) values: not equal to *invalid* (integer coordinates: raw int16, with VRMagicTransformer.invalid, or int32um, with VRMagicTransformer.coordInvalid), or not nan if *invalid* is None or nan.'
+    return ~np.isnan(C) if invalid is None or np.isnan(invalid) else C!=invalid
+def meanZ(C,A,I,invalid=None):
+    'Mean of valid z (C) values of each frame (nan if there are none).'
+    valid=validZ(C,invalid)
+    with np.errstate(invalid='ignore',divide='ignore'): return np.where(valid,C,0).sum(axis=1)/valid.sum(axis=1)
+def percentileZ(q):
+    'Return statistic computing *q*-th percentile of valid z (C) values of each frame.'
+    def percentileZ(C,A,I,invalid=None):
+        # frames without valid values give nan, don't warn about them
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore',RuntimeWarning)
+            return np.nanpercentile(np.where(validZ(C,invalid),C,np.nan),q,axis=1)
+    return percentileZ
+def validFraction(C,A,I,invalid=None):
+    'Fraction of valid z (C) values of each frame.'
+    return validZ(C,invalid).mean(axis=1)
+def meanIntensity(C,A,I):
+    'Mean intensity of each frame.'
+    return I.mean(axis=1)
+
+
+class Threshold:
+    '''
+    Condition comparing per-frame statistic *stat* (e.g. meanZ, percentileZ(90), validFraction, meanIntensity) against threshold, with hysteresis: with *above*, the condition becomes active when stat>=*on* and inactive when stat<*off* (*off* defaults to *on*); otherwise when stat<=*on* and stat>*off*. Values between *on* and *off* (and nan) keep the previous state, which is carried over between batches.
+
+    With *invalid*, coordinates equal to it are invalid (needed for integer coordinates, see validZ; VRMagicTransformer.coordInvalid for transformed frames); it is passed to *stat* as keyword argument, so custom statistics only need to accept it when it is given.
+    '''
+    def __init__(self,stat,on,off=None,above=True,invalid=None):
+        self.stat,self.on,self.off,self.above,self.invalid=stat,on,(on if off is None else off),above,invalid
+        self.state=False
+    def evaluate(self,C,A,I):
+        'Return boolean array saying whether the condition is active for each of N frames.'
+        v=self.stat(C,A,I) if self.invalid is None else self.stat(C,A,I,invalid=self.invalid)
+        with np.errstate(invalid='ignore'):
+            if self.above: on,off=(v>=self.on),(v<self.off)
+            else: on,off=(v<=self.on),(v>self.off)
+        # state of each frame is set by the last frame which switched it on or off: forward-fill of switching indices
+        idx=np.arange(len(v))
+        lastOn=np.maximum.accumulate(np.where(on,idx,-1))
+        lastOff=np.maximum.accumulate(np.where(off,idx,-1))
+        ret=np.where((lastOn<0)&(lastOff<0),self.state,lastOn>lastOff)
+        if len(ret): self.state=bool(ret[-1])
+        return ret
+
+
+class Trigger:
+    '''
+    Streaming trigger: evaluates *conditions* (Threshold instances, all of which must be active) over batches of frames in vectorized form and passes record windows to *sink*.
+
+    A window starts when conditions become active and ends *post* frames after they became inactive (it continues if they become active again before that); *pre* frames preceding the window are kept in a history buffer and prepended to it, so that the lead-in is recorded as well (never overlapping the previous window). With *requireEdge*, the first window only starts after conditions were seen inactive (so that recording does not start in the middle of an event). After *maxWindows* windows (None for unlimited), all frames are ignored (see *done*).
+
+    *sink* has methods start(windowNo), frames(C,A,I,footer) and end(windowNo), see H5WindowSink.
+    '''
+    def __init__(self,conditions,sink,width,pre=0,post=0,requireEdge=True,maxWindows=None,coordDtype='float32'):
+        self.conditions,self.sink,self.pre,self.post,self.maxWindows=conditions,sink,pre,post,maxWindows
+        self.armed=not requireEdge
+        # absolute index of the first frame of the next batch; of the last active frame; of the last frame recorded
+        self.abs0=0
+        self.lastActive=self.lastRecorded=-2**62
+        self.recording=False
+        self.windows=0
+        self.done=False
+        # pre-trigger history: last self.histLen frames before the current batch, oldest first
+        self.hist=(np.zeros((pre,width),dtype=coordDtype),np.zeros((pre,width),dtype=coordDtype),np.zeros((pre,width),dtype='uint16'),None)
+        self.histLen=0
+    def process(self,C,A,I,footer):
+        '''
+        Evaluate batch of N frames (as returned by VRMagicTransformer.payloads2arrays or Acquisition batches) and pass frames belonging to record windows to the sink.
+        '''
+        N=len(footer)
+        if self.done or N==0: return
+        active=np.ones(N,dtype=bool)
+        for c in self.conditions: active&=c.evaluate(C,A,I)
+        if not self.armed:
+            inactive=np.flatnonzero(~active)
+            if len(inactive)==0: active[:]=False
+            else:
+                active[:inactive[0]]=False
+                self.armed=True
+        ix=self.abs0+np.arange(N)
+        lastActive=np.maximum(np.maximum.accumulate(np.where(active,ix,-2**62)),self.lastActive)
+        record=(ix-lastActive)<=self.post
+        self.lastActive=int(lastActive[-1])
+        # window recorded until the end of the previous batch ends right now
+        if self.recording and not record[0] and self._endWindow(): return
+        # segments of recorded frames
+        edges=np.flatnonzero(np.diff(np.concatenate([[False],record,[False]]).astype(np.int8)))
+        for s,e in zip(edges[::2],edges[1::2]):
+            if not (s==0 and self.recording):
+                self.sink.start(self.windows)
+                self._emitPre(C,A,I,footer,s)
+            self.sink.frames(C[s:e],A[s:e],I[s:e],footer[s:e])
+            self.lastRecorded=self.abs0+e-1
+            self.recording=True
+            if e<N and self._endWindow(): return
+        self._updateHistory(C,A,I,footer)
+        self.abs0+=N
+    def close(self):
+        'End the window being recorded, if any.'
+        if self.recording: self._endWindow()
+    def _endWindow(self):
+        'End the window being recorded; return True if no more windows are to be recorded.'
+        self.sink.end(self.windows)
+        self.windows+=1
+        self.recording=False
+        self.done=(self.maxWindows is not None and self.windows>=self.maxWindows)
+        return self.done
+    def _emitPre(self,C,A,I,footer,s):
+        'Pass up to *pre* frames preceding batch index *s* (from history and the batch) to the sink.'
+        first=max(self.abs0+s-self.pre,self.lastRecorded+1,self.abs0-self.histLen)
+        if first<self.abs0:
+            h0=self.histLen-(self.abs0-first)
+            hC,hA,hI,hF=self.hist
+            self.sink.frames(hC[h0:self.histLen],hA[h0:self.histLen],hI[h0:self.histLen],hF[h0:self.histLen])
+        b0=max(first-self.abs0,0)
+        if b0<s: self.sink.frames(C[b0:s],A[b0:s],I[b0:s],footer[b0:s])
+    def _updateHistory(self,C,A,I,footer):
+        if self.pre==0: return
+        if self.hist[3] is None: self.hist=self.hist[:3]+(np.zeros(self.pre,dtype=footer.dtype),)
+        N=len(footer)
+        keep=min(self.histLen,self.pre-min(N,self.pre))
+        n=min(N,self.pre)
+        for h,d in zip(self.hist,(C,A,I,footer)):
+            h[:keep]=h[self.histLen-keep:self.histLen]
+            h[keep:keep+n]=d[N-n:]
+        self.histLen=keep+n
+
+
+class H5WindowSink:
+    '''
+    Sink for Trigger writing each record window into its own group h5root/window-NNN of *h5name*, through vrmagicH5Writer.H5Writer (*writerKw* are passed to its constructor).
+    '''
+    def __init__(self,h5name,h5root,width,raw=False,attrs={},**writerKw):
+        self.h5name,self.h5root,self.width,self.raw,self.attrs,self.writerKw=h5name,h5root,width,raw,attrs,writerKw
+        self.writer=None
+    def start(self,windowNo):
+        self.writer=vrmagicH5Writer.H5Writer(self.h5name,'%s/window-%03d'%(self.h5root,windowNo),vrmagicH5Writer.frameColumns(self.width,raw=self.raw),attrs=self.attrs,**self.writerKw)
+    def frames(self,C,A,I,footer): self.writer.appendFrames(C,A,I,footer)
+    def end(self,windowNo):
+        self.writer.close()
+        print(' {}: window {} written, {} rows'.format(self.h5name,windowNo,self.writer.stats()['rows']))
+        self.writer=None
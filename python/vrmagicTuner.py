@@ -0,0 +1,109 @@
+import time
+
+import vrmagicAcquisition
+
+
+def hasFeature(dev,name):
+    'Whether device *dev* (Aravis.Device or vrmagicSim.SimDevice) has feature *name*.'
+    return dev.get_feature(name) is not None
+
+
+class ThroughputTuner:
+    '''
+    Finds the highest frame rate camera *cam* delivers without losing frames, with the transport settings it needs and the smallest stream buffer pool which sustains it.
+
+    Each trial runs acquisition (*acqClass*, e.g. vrmagicAcquisition.SimAcquisition for simulated sensors) with *nBuffers* buffers for *settle* seconds, then measures for *measure* seconds: delivered frames/s, stream underruns, failed buffers, frames lost according to footer frame counters (only with transformer *trsf*; without it, e.g. with Aravis' fake GigE camera, payloads are not decoded) and frames dropped from the ring. A trial is loss-free if all of these are zero and delivered fps is within *tolerance* (relative) of the frame rate set on the device. The consumer only releases frames (the ring holds *ringSize* frames, or payloads without transformer), so that the trial measures transport and decoding.
+
+    tune() searches frame rates from the maximum (AcquisitionFrameRateMax_mHz, which depends on AOI; or frame rate bounds of cameras without the VRMagic feature) down by fractions *rates*, refining between the lowest failing and highest loss-free rate by bisection (*refine* steps); at each rate, combinations of *packetSizes* (GevSCPSPacketSize, bytes, limited to bounds of the device) and *packetDelays* (GevSCPD, timestamp ticks) are tried in order (largest packets and shortest delays first) with the largest of *buffers*, until one is loss-free. Buffer counts are then tried in ascending order with the chosen settings. Transport features the device does not have are not swept.
+    '''
+    def __init__(self,cam,trsf=None,packetSizes=(9000,8192,4096,1500),packetDelays=(0,1000,4000),rates=(1.,.75,.5,.25,.1),refine=3,buffers=(4,8,16,32,64,128,256,512,1024,2048),settle=1.,measure=3.,tolerance=.01,ringSize=256,acqClass=vrmagicAcquisition.Acquisition,log=print):
+        self.cam,self.trsf,self.dev=cam,trsf,cam.get_device()
+        self.rates,self.refine,self.buffers,self.settle,self.measure,self.tolerance,self.ringSize,self.acqClass,self.log=rates,refine,sorted(buffers),settle,measure,tolerance,ringSize,acqClass,log
+        self.mHz=hasFeature(self.dev,'AcquisitionFrameRate_mHz')
+        if hasFeature(self.dev,'GevSCPSPacketSize'):
+            lo,hi=self.dev.get_integer_feature_bounds('GevSCPSPacketSize')
+            self.packetSizes=[p for p in packetSizes if lo<=p<=hi] or [self.dev.get_integer_feature_value('GevSCPSPacketSize')]
+        else: self.packetSizes=[None]
+        self.packetDelays=list(packetDelays) if hasFeature(self.dev,'GevSCPD') else [None]
+        # settings before tuning, restored unless applying the result
+        self.original=self.settings()
+        self.trials=[]
+    def settings(self):
+        'Return current settings as dict: packetSize, packetDelay (None if the device does not have them) and frameRate (Hz).'
+        d=self.dev
+        return dict(packetSize=d.get_integer_feature_value('GevSCPSPacketSize') if self.packetSizes!=[None] else None,packetDelay=d.get_integer_feature_value('GevSCPD') if self.packetDelays!=[None] else None,frameRate=d.get_integer_feature_value('AcquisitionFrameRate_mHz')/1000. if self.mHz else self.cam.get_frame_rate())
+    def apply(self,packetSize=None,packetDelay=None,frameRate=None):
+        'Set those of the settings which are not None on the device; return settings as read back (the device may round or clamp them).'
+        d=self.dev
+        if packetSize is not None: d.set_integer_feature_value('GevSCPSPacketSize',int(packetSize))
+        if packetDelay is not None: d.set_integer_feature_value('GevSCPD',int(packetDelay))
+        if frameRate is not None:
+            if self.mHz: d.set_integer_feature_value('AcquisitionFrameRate_mHz',int(1000*frameRate))
+            else: self.cam.set_frame_rate(frameRate)
+        return self.settings()
+    def maxFrameRate(self):
+        'Maximum frame rate (Hz) for the current AOI.'
+        if self.mHz: return self.dev.get_integer_feature_value('AcquisitionFrameRateMax_mHz')/1000.
+        return self.cam.get_frame_rate_bounds()[1]
+    def _counters(self,acq):
+        return dict(frames=acq.frames,underruns=acq.streamStats()['underruns'],failures=acq.failures,lost=acq.gaps.lostFrames,dropped=acq.ring.dropped)
+    def trial(self,nBuffers,**settings):
+        'Apply *settings* (see apply), acquire with *nBuffers* buffers and return measurements as dict (with settings, nBuffers, fps and lossFree); trials are also appended to *trials*.'
+        ret=dict(self.apply(**settings),nBuffers=nBuffers)
+        acq=self.acqClass(self.cam,self.trsf,nBuffers=nBuffers,ringSize=self.ringSize,policy='dropOldest',raw=True)
+        ring=acq.ring
+        acq.start()
+        try:
+            t0=time.time()
+            c0=None
+            while True:
+                ring.release(len(ring.peek(None,timeout=.05)[-1]))
+                now=time.time()
+                if c0 is None and now-t0>=self.settle: c0,t1=self._counters(acq),now
+                if c0 is not None and now-t1>=self.measure: break
+            c1=self._counters(acq)
+        finally:
+            acq.stop()
+            acq.close()
+        ret.update({k:c1[k]-c0[k] for k in c1})
+        ret['fps']=ret['frames']/(now-t1)
+        ret['lossFree']=ret['underruns']==ret['failures']==ret['lost']==ret['dropped']==0 and ret['fps']>=(1-self.tolerance)*ret['frameRate']
+        self.trials.append(ret)
+        self.log('%(frameRate)9.1f Hz  packet %(packetSize)s B  delay %(packetDelay)s  buffers %(nBuffers)4d: %(fps)9.1f fps, %(underruns)d underruns, %(failures)d failures, %(lost)d lost, %(dropped)d dropped'%ret+('' if ret['lossFree'] else '  LOSS'))
+        return ret
+    def _atRate(self,rate):
+        'First loss-free trial at *rate* over transport settings, or None.'
+        for ps in self.packetSizes:
+            for pd in self.packetDelays:
+                ret=self.trial(self.buffers[-1],packetSize=ps,packetDelay=pd,frameRate=rate)
+                if ret['lossFree']: return ret
+        return None
+    def tune(self,apply=False):
+        '''
+        Search settings (see class documentation); with *apply*, leave the best settings on the device, otherwise restore the original ones. Return the best (loss-free) trial with the smallest buffer pool (see trial), or None if even the lowest rate loses frames.
+        '''
+        best=settings=None
+        try:
+            fmax=self.maxFrameRate()
+            failed=None
+            for f in self.rates:
+                best=self._atRate(f*fmax)
+                if best: break
+                failed=f*fmax
+            if best is None: return None
+            # bisection between the highest loss-free and the lowest failing rate
+            lo,hi=best['frameRate'],failed
+            for i in range(self.refine if hi else 0):
+                ret=self._atRate(.5*(lo+hi))
+                if ret: best,lo=ret,ret['frameRate']
+                else: hi=.5*(lo+hi)
+            settings=dict(packetSize=best['packetSize'],packetDelay=best['packetDelay'],frameRate=best['frameRate'])
+            for n in self.buffers[:-1]:
+                ret=self.trial(n,**settings)
+                if ret['lossFree']:
+                    best=ret
+                    break
+            return best
+        finally:
+            if not apply: self.apply(**self.original)
+            elif settings: self.apply(**settings)